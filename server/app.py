@@ -5,16 +5,40 @@
 # Remote library imports
 from flask import request, make_response
 from flask_restful import Resource
+from sqlalchemy.orm import selectinload, load_only
 from datetime import datetime
 from faker import Faker
 import re
+from urllib.parse import urlencode
 # Local imports
 from config import app, db, api
-from models import User, City, CityNote, Location, LocationNote
+from models import User, City, CityNote, Location, LocationNote, Job
+from pagination import filter_query, paginate, page_args
+from streaming import wants_stream, stream_response
+from serializers import serialize
+from fieldsets import fieldset
+from auth import owner_required, email_cache
+from cache import response_cache, user_tags, city_tags, location_tags
+from summary import city_summary
+from search import DOC_TYPES, search_documents
+from stats import user_stats
+from conditional import user_version, city_version, location_version, not_modified, with_version
+from geo import coordinate, point_fields, parse_bbox, bbox_clause, radius_bbox, distance_m
+from pool import pool_metrics
+from metrics import render as render_metrics
+from batch import BatchError, MAX_ASYNC_BATCH, batch_items, create_all, update_all, delete_all
+from jobs import JobError, job, enqueue, accepted, wants_async, job_stats
+from loaders import USER_LOADERS, CITY_LOADERS, CITY_NOTE_LOADERS, LOCATION_LOADERS, LOCATION_NOTE_LOADERS
 
 faker = Faker()
 
 
+def parse_date_visited(value):
+    if value is None:
+        return value
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+
+
 class Home(Resource):
     def get(self):
         return make_response({'message': 'Vicariously API is running!'}, 202)
@@ -24,16 +48,25 @@ api.add_resource(Home, '/')
 
 
 class Users(Resource):
+    loaders = USER_LOADERS
+    filters = ('username', 'travel_style',)
+
     def get(self):
         try:
-            users = [user.to_dict() for user in User.query.all()]
-            if not users:
+            view = fieldset(User, request.args, self.loaders)
+            query = filter_query(User.query.options(*view.options), User, request.args, self.filters)
+            if wants_stream(request):
+                return stream_response(query, User, view.serialize)
+            page, next_url = paginate(query, User, request.args)
+            if not page and 'after' not in request.args:
                 return make_response({'error': 'no users exist'}, 404)
             return make_response(
-                users,
+                {'data': [view.serialize(user) for user in page], 'next': next_url},
                 200,
                 {"Content-Type": "application/json"}
             )
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
         except Exception as e:
             return make_response({'message': 'Something went wrong!', 'stackTrace': e}, 400)
 
@@ -42,22 +75,43 @@ api.add_resource(Users, '/users')
 
 
 class UserByUsername(Resource):
+    loaders = USER_LOADERS
+
     def get(self, username):
-        user = User.query.filter_by(username=username).first()
+        try:
+            view = fieldset(User, request.args, self.loaders)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        user = User.query.options(*view.options).filter_by(username=username).first()
         if not user:
             return make_response({'error': 'User not found'}, 404)
-        return make_response(user.to_dict(), 200, {"Content-Type": "application/json"})
+        return make_response(view.serialize(user), 200, {"Content-Type": "application/json"})
 
 
 api.add_resource(UserByUsername, '/users/<username>')
 
 
 class UserById(Resource):
+    loaders = USER_LOADERS
+
     def get(self, id):
-        user = User.query.filter_by(id=id).first()
+        try:
+            view = fieldset(User, request.args, self.loaders)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        version = user_version(id)
+        if not version:
+            return make_response({'error': 'User not found'}, 404)
+        unchanged = not_modified(version)
+        if unchanged:
+            return unchanged
+        cached = response_cache.lookup(version)
+        if cached:
+            return with_version(cached, version)
+        user = User.query.options(*view.options).filter_by(id=id).first()
         if not user:
             return make_response({'error': 'User not found'}, 404)
-        return make_response(user.to_dict(), 200, {"Content-Type": "application/json"})
+        return with_version(response_cache.store(view.serialize(user), user_tags(user), version), version)
 
     def patch(self, id):
         data = request.get_json()
@@ -74,17 +128,16 @@ class UserById(Resource):
             db.session.commit()
         except Exception as ex:
             return make_response({'error': [ex.__str__()]}, 422)
-        return make_response(user.to_dict(), 202)
+        return make_response(serialize(user), 202)
 
+    @owner_required
     def delete(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-
         user = User.query.filter_by(id=id).first()
         if not user:
             return make_response({'error': 'user not found'}, 404)
+        if wants_async(request):
+            return accepted(enqueue('delete_user', {'id': id}))
         db.session.delete(user)
         db.session.commit()
         return make_response(f"deleted ok", 200)
@@ -93,10 +146,34 @@ class UserById(Resource):
 api.add_resource(UserById, '/users/<int:id>')
 
 
+@job('delete_user', concurrency=2)
+def delete_user(payload):
+    user = db.session.get(User, payload['id'])
+    if user:
+        db.session.delete(user)
+        db.session.commit()
+    return {'deleted': user is not None}
+
+
+class UserStatsById(Resource):
+    def get(self, id):
+        stats = user_stats(id)
+        if stats is None:
+            return make_response({'error': 'User not found'}, 404)
+        return make_response(stats, 200)
+
+
+api.add_resource(UserStatsById, '/users/<int:id>/stats')
+
+
 class Login(Resource):
     def post(self):
         data = request.get_json()
-        user = User.query.filter_by(email=data['email']).first()
+        try:
+            view = fieldset(User, request.args, rules=("-cities",))
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        user = User.query.options(*view.options).filter_by(email=data['email']).first()
         if not user:
             try:
                 new_user = User(
@@ -105,35 +182,42 @@ class Login(Resource):
                     )
                 db.session.add(new_user)
                 db.session.commit()
-                print(new_user.to_dict())
             except Exception as errors:
                 return make_response({"errors": [errors.__str__()]}, 422)
-            return make_response(new_user.to_dict(rules=("-cities",)), 201)
-        return make_response(user.to_dict(rules=("-cities",)), 200, {"Content-Type": "application/json"})
+            return make_response(view.serialize(new_user), 201)
+        return make_response(view.serialize(user), 200, {"Content-Type": "application/json"})
 
 
 api.add_resource(Login, '/login')
 
 
 class Cities(Resource):
+    loaders = CITY_LOADERS
+    filters = ('user_id', 'country', 'city_name',)
+
     def get(self):
         try:
-            cities = [city.to_dict() for city in City.query.all()]
-            if not cities:
+            # image lists are only sent (and read) for ?include=city_imgs
+            view = fieldset(City, request.args, self.loaders, ("-city_imgs",))
+            query = filter_query(City.query.options(*view.options), City, request.args, self.filters)
+            if wants_stream(request):
+                return stream_response(query, City, view.serialize)
+            page, next_url = paginate(query, City, request.args)
+            if not page and 'after' not in request.args:
                 return make_response({'error': 'no cities exist'}, 404)
             return make_response(
-                cities,
+                {'data': [view.serialize(city) for city in page], 'next': next_url},
                 200,
                 {"Content-Type": "application/json"}
             )
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
         except Exception as e:
             return make_response({'message': 'Something went wrong!', 'stackTrace': e}, 400)
 
+    @owner_required
     def post(self):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         try:
             new_city = City(
                 city_name=data['city_name'],
@@ -145,25 +229,37 @@ class Cities(Resource):
             db.session.commit()
         except Exception as errors:
             return make_response({"errors": [errors.__str__()]}, 422)
-        return make_response(new_city.to_dict(), 201)
+        return make_response(serialize(new_city), 201)
 
 
 api.add_resource(Cities, '/cities')
 
 
 class CityById(Resource):
+    loaders = CITY_LOADERS
+
     def get(self, id):
-        print(datetime.now())
-        city = City.query.filter_by(id=id).first()
+        try:
+            view = fieldset(City, request.args, self.loaders, ("-city_imgs",))
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        version = city_version(id)
+        if not version:
+            return make_response({'error': 'City not found'}, 404)
+        unchanged = not_modified(version)
+        if unchanged:
+            return unchanged
+        cached = response_cache.lookup(version)
+        if cached:
+            return with_version(cached, version)
+        city = City.query.options(*view.options).filter_by(id=id).first()
         if not city:
             return make_response({'error': 'City not found'}, 404)
-        return make_response(city.to_dict(rules=("-city_imgs",)), 200, {"Content-Type": "application/json"})
+        return with_version(response_cache.store(view.serialize(city), city_tags(city), version), version)
 
+    @owner_required
     def patch(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         city = City.query.filter_by(id=id).first()
         if not city:
             return make_response({'error': 'City not found'}, 404)
@@ -174,17 +270,16 @@ class CityById(Resource):
             db.session.commit()
         except Exception as ex:
             return make_response({'error': [ex.__str__()]}, 422)
-        return make_response(city.to_dict(), 202)
+        return make_response(serialize(city), 202)
 
+    @owner_required
     def delete(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-
         city = City.query.filter_by(id=id).first()
         if not city:
             return make_response({'error': 'city not found'}, 404)
+        if wants_async(request):
+            return accepted(enqueue('delete_city', {'id': id}))
         db.session.delete(city)
         db.session.commit()
         return make_response(f"deleted ok", 200)
@@ -193,25 +288,70 @@ class CityById(Resource):
 api.add_resource(CityById, '/cities/<int:id>')
 
 
+@job('delete_city', concurrency=2)
+def delete_city(payload):
+    city = db.session.get(City, payload['id'])
+    if city:
+        db.session.delete(city)
+        db.session.commit()
+    return {'deleted': city is not None}
+
+
+class CitySummary(Resource):
+    loaders = (selectinload(City.locations).selectinload(Location.location_notes),)
+
+    def get(self, id):
+        version = city_version(id)
+        if not version:
+            return make_response({'error': 'City not found'}, 404)
+        unchanged = not_modified(version)
+        if unchanged:
+            return unchanged
+        # full location rows only on ?include=locations
+        include_locations = 'locations' in request.args.get('include', '').split(',')
+        if include_locations:
+            query = City.query.options(*self.loaders)
+        else:
+            query = City.query.options(load_only(City.id, City.city_name, City.country, City.user_id))
+        city = query.filter_by(id=id).first()
+        if not city:
+            # deleted since the version check
+            return make_response({'error': 'City not found'}, 404)
+        summary = city_summary(city)
+        if include_locations:
+            summary['locations'] = [serialize(location) for location in city.locations]
+        return with_version(make_response(summary, 200), version)
+
+
+api.add_resource(CitySummary, '/cities/<int:id>/summary')
+
+
 class CityNotes(Resource):
+    loaders = CITY_NOTE_LOADERS
+    filters = ('city_id', 'note_type',)
+
     def get(self):
         try:
-            notes = [note.to_dict() for note in CityNote.query.all()]
-            if not notes:
+            view = fieldset(CityNote, request.args, self.loaders)
+            query = filter_query(CityNote.query.options(*view.options), CityNote, request.args, self.filters)
+            if wants_stream(request):
+                return stream_response(query, CityNote, view.serialize)
+            page, next_url = paginate(query, CityNote, request.args)
+            if not page and 'after' not in request.args:
                 return make_response({'error': 'no notes exist'}, 404)
             return make_response(
-                notes,
+                {'data': [view.serialize(note) for note in page], 'next': next_url},
                 200,
                 {"Content-Type": "application/json"}
             )
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
         except Exception as e:
             return make_response({'message': 'Something went wrong!', 'stackTrace': e}, 400)
 
+    @owner_required
     def post(self):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         try:
             newCityNote = CityNote(
                 note_body=data['note_body'],
@@ -222,25 +362,29 @@ class CityNotes(Resource):
             db.session.commit()
         except Exception as errors:
             return make_response({"errors": [errors.__str__()]}, 422)
-        return make_response(newCityNote.to_dict(), 201)
+        return make_response(serialize(newCityNote), 201)
 
 
 api.add_resource(CityNotes, '/citynotes')
 
 
 class CityNotesById(Resource):
+    loaders = CITY_NOTE_LOADERS
+
     def get(self, id):
-        cityNote = CityNote.query.filter_by(id=id).first()
+        try:
+            view = fieldset(CityNote, request.args, self.loaders)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        cityNote = CityNote.query.options(*view.options).filter_by(id=id).first()
         if not cityNote:
             return make_response({'error': 'City Note not found'}, 404)
-        return make_response(cityNote.to_dict(), 200, {"Content-Type": "application/json"})
+        return make_response(view.serialize(cityNote), 200, {"Content-Type": "application/json"})
 
+    @owner_required
     def patch(self, id):
         data = request.get_json()
         cityNote = CityNote.query.filter_by(id=id).first()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         if not cityNote:
             return make_response({'error': 'City Note not found'}, 404)
         try:
@@ -250,14 +394,11 @@ class CityNotesById(Resource):
             db.session.commit()
         except Exception as ex:
             return make_response({'error': [ex.__str__()]}, 422)
-        return make_response(cityNote.to_dict(), 202)
+        return make_response(serialize(cityNote), 202)
 
+    @owner_required
     def delete(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-
         cityNote = CityNote.query.filter_by(id=id).first()
         if not cityNote:
             return make_response({'error': 'City Note not found'}, 404)
@@ -270,30 +411,32 @@ api.add_resource(CityNotesById, '/citynotes/<int:id>')
 
 
 class Locations(Resource):
+    loaders = LOCATION_LOADERS
+    filters = ('user_id', 'city_id', 'category', 'rating', 'avg_cost', 'date_visited',)
+
     def get(self):
         try:
-            locations = [location.to_dict()
-                         for location in Location.query.all()]
-            if not locations:
+            view = fieldset(Location, request.args, self.loaders)
+            query = filter_query(Location.query.options(*view.options), Location, request.args, self.filters)
+            if wants_stream(request):
+                return stream_response(query, Location, view.serialize)
+            page, next_url = paginate(query, Location, request.args)
+            if not page and 'after' not in request.args:
                 return make_response({'error': 'no locations exist'}, 404)
             return make_response(
-                locations,
+                {'data': [view.serialize(location) for location in page], 'next': next_url},
                 200,
                 {"Content-Type": "application/json"}
             )
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
         except Exception as e:
             return make_response({'message': 'Something went wrong!', 'stackTrace': e}, 400)
 
+    @owner_required
     def post(self):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-        if data['date_visited'] is None:
-            date_v = data['date_visited']
-        else:
-            date_v = datetime.strptime(
-                data['date_visited'], "%Y-%m-%dT%H:%M:%S.%fZ")
+        date_v = parse_date_visited(data['date_visited'])
         try:
             new_loc = Location(
                 location_name=data['location_name'],
@@ -303,6 +446,8 @@ class Locations(Resource):
                 website=data['website'],
                 date_visited=date_v,
                 rating=data['rating'],
+                lat=data.get('lat'),
+                lng=data.get('lng'),
                 user_id=data['user_id'],
                 city_id=data['city_id']
             )
@@ -310,25 +455,181 @@ class Locations(Resource):
             db.session.commit()
         except Exception as errors:
             return make_response({"errors": [errors.__str__()]}, 422)
-        return make_response(new_loc.to_dict(), 201)
+        return make_response(serialize(new_loc), 201)
 
 
 api.add_resource(Locations, '/locations')
 
 
+def location_row(item, user_id):
+    # insert() skips the mapper events, so the point is resolved here
+    return {
+        'location_name': item.get('location_name'),
+        'category': item.get('category'),
+        'avg_cost': item.get('avg_cost'),
+        'google_map_url': item.get('google_map_url'),
+        'website': item.get('website'),
+        'date_visited': parse_date_visited(item.get('date_visited')),
+        'rating': item.get('rating'),
+        'user_id': user_id,
+        'city_id': item.get('city_id'),
+        **point_fields(item.get('lat'), item.get('lng'), item.get('google_map_url')),
+    }
+
+
+class LocationsBatch(Resource):
+    @owner_required
+    def post(self):
+        data = request.get_json()
+        run_async = wants_async(request)
+        try:
+            items = batch_items(data, limit=MAX_ASYNC_BATCH if run_async else None)
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        if run_async:
+            return accepted(enqueue('import_locations', {'user_id': data['user_id'], 'items': items}))
+        ids, errors = create_all(Location, items, lambda item: location_row(item, data['user_id']))
+        if errors:
+            return make_response({'errors': errors}, 422)
+        return make_response({'ids': ids}, 201)
+
+    @owner_required
+    def patch(self):
+        data = request.get_json()
+        try:
+            items = batch_items(data, updates=True)
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        locations, errors = update_all(Location, items)
+        if errors:
+            return make_response({'errors': errors}, 422)
+        return make_response({'data': [serialize(location) for location in locations]}, 202)
+
+    @owner_required
+    def delete(self):
+        data = request.get_json()
+        try:
+            ids = batch_items(data, 'ids')
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        if wants_async(request):
+            return accepted(enqueue('delete_locations', {'ids': ids}))
+        deleted, errors = delete_all(Location, ids)
+        if errors:
+            return make_response({'errors': errors}, 404)
+        return make_response({'deleted': deleted}, 200)
+
+
+api.add_resource(LocationsBatch, '/locations:batch')
+
+
+@job('import_locations', concurrency=2)
+def import_locations(payload):
+    ids, errors = create_all(Location, payload['items'],
+                             lambda item: location_row(item, payload['user_id']))
+    if any(error['index'] is not None for error in errors):
+        raise JobError('items were rejected; nothing was imported', {'errors': errors})
+    if errors:
+        # the insert itself failed (locked database, lost connection): retry
+        raise RuntimeError(errors[0]['error'])
+    return {'ids': ids}
+
+
+@job('delete_locations', concurrency=2)
+def delete_locations(payload):
+    # a retry may find some rows already gone, which is not an error here
+    ids = [id for (id,) in db.session.query(Location.id).filter(Location.id.in_(payload['ids']))]
+    deleted, _ = delete_all(Location, ids)
+    return {'deleted': deleted}
+
+
+class LocationsWithin(Resource):
+    loaders = LOCATION_LOADERS
+    filters = ('user_id', 'city_id', 'category',)
+
+    def get(self):
+        try:
+            box = parse_bbox(request.args.get('bbox'))
+            view = fieldset(Location, request.args, self.loaders)
+            query = filter_query(Location.query.options(*view.options), Location, request.args, self.filters)
+            page, next_url = paginate(query.filter(bbox_clause(Location, *box)), Location, request.args)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        return make_response(
+            {'data': [view.serialize(location) for location in page], 'next': next_url},
+            200,
+            {"Content-Type": "application/json"}
+        )
+
+
+api.add_resource(LocationsWithin, '/locations/within')
+
+
+class LocationsNear(Resource):
+    loaders = LOCATION_LOADERS
+    filters = ('user_id', 'city_id', 'category',)
+    max_radius = 50_000
+
+    def get(self):
+        try:
+            lat, lng = (coordinate(key, float(request.args[key])) for key in ('lat', 'lng'))
+            radius = float(request.args.get('radius', 1000))
+            if not 0 < radius <= self.max_radius:
+                raise ValueError(f'radius must be between 0 and {self.max_radius} meters.')
+            limit, _ = page_args(request.args)
+            view = fieldset(Location, request.args, self.loaders)
+            points = filter_query(Location.query.with_entities(Location.id, Location.lat, Location.lng),
+                                  Location, request.args, self.filters)
+        except KeyError:
+            return make_response({'error': 'lat and lng must be provided.'}, 400)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        # candidates come from the box around the circle as bare points; only
+        # the nearest `limit` inside the radius are loaded in full
+        nearby = []
+        for id, point_lat, point_lng in points.filter(bbox_clause(Location, *radius_bbox(lat, lng, radius))):
+            distance = distance_m(lat, lng, point_lat, point_lng)
+            if distance <= radius:
+                nearby.append((distance, id))
+        nearby = sorted(nearby)[:limit]
+        found = {location.id: location for location in
+                 Location.query.options(*view.options).filter(Location.id.in_([id for _, id in nearby]))}
+        return make_response(
+            {'data': [{**view.serialize(found[id]), 'distance_m': round(distance, 1)} for distance, id in nearby]},
+            200,
+            {"Content-Type": "application/json"}
+        )
+
+
+api.add_resource(LocationsNear, '/locations/near')
+
+
 class LocationById(Resource):
+    loaders = LOCATION_LOADERS
+
     def get(self, id):
-        location = Location.query.filter_by(id=id).first()
+        try:
+            view = fieldset(Location, request.args, self.loaders)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        version = location_version(id)
+        if not version:
+            return make_response({'error': 'Location not found'}, 404)
+        unchanged = not_modified(version)
+        if unchanged:
+            return unchanged
+        cached = response_cache.lookup(version)
+        if cached:
+            return with_version(cached, version)
+        location = Location.query.options(*view.options).filter_by(id=id).first()
         if not location:
             return make_response({'error': 'Location not found'}, 404)
-        return make_response(location.to_dict(), 200, {"Content-Type": "application/json"})
+        return with_version(response_cache.store(view.serialize(location), location_tags(location), version), version)
 
+    @owner_required
     def patch(self, id):
         data = request.get_json()
         location = Location.query.filter_by(id=id).first()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         if not location:
             return make_response({'error': 'Location not found'}, 404)
         try:
@@ -338,14 +639,11 @@ class LocationById(Resource):
             db.session.commit()
         except Exception as ex:
             return make_response({'error': [ex.__str__()]}, 422)
-        return make_response(location.to_dict(), 202)
+        return make_response(serialize(location), 202)
 
+    @owner_required
     def delete(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-
         location = Location.query.filter_by(id=id).first()
         if not location:
             return make_response({'error': 'location not found'}, 404)
@@ -358,24 +656,31 @@ api.add_resource(LocationById, '/locations/<int:id>')
 
 
 class LocationNotes(Resource):
+    loaders = LOCATION_NOTE_LOADERS
+    filters = ('location_id',)
+
     def get(self):
         try:
-            notes = [note.to_dict() for note in LocationNote.query.all()]
-            if not notes:
+            view = fieldset(LocationNote, request.args, self.loaders)
+            query = filter_query(LocationNote.query.options(*view.options), LocationNote, request.args, self.filters)
+            if wants_stream(request):
+                return stream_response(query, LocationNote, view.serialize)
+            page, next_url = paginate(query, LocationNote, request.args)
+            if not page and 'after' not in request.args:
                 return make_response({'error': 'no notes exist'}, 404)
             return make_response(
-                notes,
+                {'data': [view.serialize(note) for note in page], 'next': next_url},
                 200,
                 {"Content-Type": "application/json"}
             )
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
         except Exception as e:
             return make_response({'message': 'Something went wrong!', 'stackTrace': e}, 400)
 
+    @owner_required
     def post(self):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         try:
             newLocationNote = LocationNote(
                 note_body=data['note_body'],
@@ -385,25 +690,73 @@ class LocationNotes(Resource):
             db.session.commit()
         except Exception as errors:
             return make_response({"errors": [errors.__str__()]}, 422)
-        return make_response(newLocationNote.to_dict(), 201)
+        return make_response(serialize(newLocationNote), 201)
 
 
 api.add_resource(LocationNotes, '/locationnotes')
 
 
+class LocationNotesBatch(Resource):
+    @owner_required
+    def post(self):
+        data = request.get_json()
+        try:
+            items = batch_items(data)
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        ids, errors = create_all(LocationNote, items, lambda item: {
+            'note_body': item.get('note_body'),
+            'location_id': item.get('location_id'),
+        })
+        if errors:
+            return make_response({'errors': errors}, 422)
+        return make_response({'ids': ids}, 201)
+
+    @owner_required
+    def patch(self):
+        data = request.get_json()
+        try:
+            items = batch_items(data, updates=True)
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        notes, errors = update_all(LocationNote, items)
+        if errors:
+            return make_response({'errors': errors}, 422)
+        return make_response({'data': [serialize(note) for note in notes]}, 202)
+
+    @owner_required
+    def delete(self):
+        data = request.get_json()
+        try:
+            ids = batch_items(data, 'ids')
+        except BatchError as ex:
+            return make_response({'error': ex.__str__()}, 400)
+        deleted, errors = delete_all(LocationNote, ids)
+        if errors:
+            return make_response({'errors': errors}, 404)
+        return make_response({'deleted': deleted}, 200)
+
+
+api.add_resource(LocationNotesBatch, '/locationnotes:batch')
+
+
 class LocationNotesById(Resource):
+    loaders = LOCATION_NOTE_LOADERS
+
     def get(self, id):
-        location_note = LocationNote.query.filter_by(id=id).first()
+        try:
+            view = fieldset(LocationNote, request.args, self.loaders)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        location_note = LocationNote.query.options(*view.options).filter_by(id=id).first()
         if not location_note:
             return make_response({'error': 'Location note not found'}, 404)
-        return make_response(location_note.to_dict(), 200, {"Content-Type": "application/json"})
+        return make_response(view.serialize(location_note), 200, {"Content-Type": "application/json"})
 
+    @owner_required
     def patch(self, id):
         data = request.get_json()
         location_note = LocationNote.query.filter_by(id=id).first()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
         if not location_note:
             return make_response({'error': 'Location Note not found'}, 404)
         try:
@@ -413,14 +766,11 @@ class LocationNotesById(Resource):
             db.session.commit()
         except Exception as ex:
             return make_response({'error': [ex.__str__()]}, 422)
-        return make_response(location_note.to_dict(), 202)
+        return make_response(serialize(location_note), 202)
 
+    @owner_required
     def delete(self, id):
         data = request.get_json()
-        user_val = User.query.filter_by(email=data['val_user_email']).first()
-        if user_val.id != data['user_id']:
-            return make_response({'error': 'permissions mismatch'}, 400)
-
         location_note = LocationNote.query.filter_by(id=id).first()
         if not location_note:
             return make_response({'error': 'location note not found'}, 404)
@@ -431,5 +781,64 @@ class LocationNotesById(Resource):
 
 api.add_resource(LocationNotesById, '/locationnotes/<int:id>')
 
+
+class Search(Resource):
+    def get(self):
+        q = request.args.get('q', '').strip()
+        types = [t for t in request.args.get('types', '').split(',') if t]
+        if not q:
+            return make_response({'error': 'q must be provided.'}, 400)
+        if any(t not in DOC_TYPES for t in types):
+            return make_response({'error': f'types must be among {", ".join(DOC_TYPES)}.'}, 400)
+        try:
+            limit, _ = page_args(request.args)
+            offset = int(request.args.get('offset', 0))
+            if offset < 0:
+                raise ValueError('offset must not be negative.')
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        rows = search_documents(q, types, limit + 1, offset)
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_args = {**request.args.to_dict(), 'limit': limit, 'offset': offset + limit}
+            next_url = f'{request.base_url}?{urlencode(next_args)}'
+        return make_response({
+            'data': [{'type': doc_type, 'id': doc_id, 'text': body, 'rank': rank}
+                     for doc_type, doc_id, body, rank in rows],
+            'next': next_url,
+        }, 200)
+
+
+api.add_resource(Search, '/search')
+
+
+class JobById(Resource):
+    def get(self, id):
+        try:
+            view = fieldset(Job, request.args)
+        except ValueError as e:
+            return make_response({'error': str(e)}, 400)
+        found = Job.query.options(*view.options).filter_by(id=id).first()
+        if not found:
+            return make_response({'error': 'Job not found'}, 404)
+        headers = {"Content-Type": "application/json"}
+        if found.status in ('queued', 'running'):
+            headers['Retry-After'] = '1'
+        return make_response(view.serialize(found), 200, headers)
+
+
+api.add_resource(JobById, '/jobs/<int:id>')
+
+
+class Metrics(Resource):
+    def get(self):
+        body = render_metrics(pool_metrics.stats(db.engine.pool), response_cache.stats(), email_cache.stats(),
+                              job_stats())
+        return make_response(body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+api.add_resource(Metrics, '/metrics')
+
 if __name__ == '__main__':
     app.run(port=8000, debug=True)
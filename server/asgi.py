@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Optional ASGI entry point serving the same resources as app.py over an
+# async engine: asyncpg for Postgres, aiosqlite for SQLite.
+#
+#   pipenv install --categories asgi   # uvicorn, asyncpg and aiosqlite
+#   gunicorn -w 4 -k uvicorn.workers.UvicornWorker asgi:app
+#
+# Each request runs the Flask app in a greenlet on the event loop, the same
+# bridge SQLAlchemy's own asyncio extension uses: every database round trip
+# awaits the async driver and hands the loop to other requests, so a slow
+# query holds a connection but not the worker. Code that blocks without
+# going through SQLAlchemy (the redis cache client) still blocks the loop.
+
+# Standard library imports
+import importlib.util
+import io
+import os
+import sys
+
+# Remote library imports
+from sqlalchemy.engine import make_url
+from sqlalchemy.util import greenlet_spawn
+
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise RuntimeError(f'no async driver for {url.get_backend_name()} databases.')
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}').render_as_string(hide_password=False)
+
+
+# config.py builds the engine from DATABASE_URI on import, so the async
+# driver has to be chosen first. ASYNC_DATABASE_URI overrides the mapping.
+os.environ['DATABASE_URI'] = (os.environ.get('ASYNC_DATABASE_URI')
+                              or async_database_uri(os.environ['DATABASE_URI']))
+_driver = make_url(os.environ['DATABASE_URI']).get_driver_name()
+if importlib.util.find_spec(_driver) is None:
+    raise RuntimeError(f'asgi.py needs the {_driver} driver, which is not installed; '
+                       'install the asgi extras with `pipenv install --categories asgi`.')
+
+# Local imports
+from app import app as flask_app
+from config import db
+
+_DONE = object()
+
+
+def _environ(scope, body):
+    """WSGI environ (PEP 3333) for an ASGI http scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path'][len(root_path):] if scope['path'].startswith(root_path) else scope['path']
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def _http(scope, receive, send):
+    environ = _environ(scope, await _read_body(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1'))
+                              for name, value in headers]
+
+    # the view, and for streamed bodies each chunk, runs in a greenlet so
+    # the sync SQLAlchemy calls inside it can await the async driver
+    body = await greenlet_spawn(flask_app.wsgi_app, environ, start_response)
+    try:
+        await send({'type': 'http.response.start', 'status': started['status'],
+                    'headers': started['headers']})
+        if isinstance(body, (list, tuple)):
+            for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        else:
+            chunks = iter(body)
+            while (chunk := await greenlet_spawn(next, chunks, _DONE)) is not _DONE:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        if hasattr(body, 'close'):
+            await greenlet_spawn(body.close)
+
+
+async def _lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            with flask_app.app_context():
+                await greenlet_spawn(db.engine.dispose)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await _http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await _lifespan(scope, receive, send)
+    else:
+        raise RuntimeError(f'{scope["type"]} connections are not supported.')
@@ -0,0 +1,102 @@
+# Standard library imports
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Remote library imports
+from flask import g, request, make_response
+from sqlalchemy import event
+
+# Local imports
+from config import db
+from models import User
+
+
+class EmailCache:
+    """Bounded LRU of email -> user id whose entries expire after `ttl`
+    seconds. Only hits are cached, so a new sign-up is seen right away."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email):
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[email]
+            self.misses += 1
+            return None
+
+    def set(self, email, user_id):
+        with self._lock:
+            self._entries[email] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for email in [e for e, (uid, _) in self._entries.items() if uid == user_id]:
+                del self._entries[email]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+email_cache = EmailCache()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    email_cache.invalidate_user(target.id)
+
+
+def user_id_for_email(email):
+    """Resolves the caller at most once per request."""
+    resolved = g.setdefault('resolved_emails', {})
+    if email in resolved:
+        return resolved[email]
+    user_id = email_cache.get(email)
+    if user_id is None and email:
+        user_id = db.session.query(User.id).filter_by(email=email).scalar()
+        if user_id is not None:
+            email_cache.set(email, user_id)
+    resolved[email] = user_id
+    return user_id
+
+
+def owner_required(method):
+    """Rejects the request unless `val_user_email` in the body belongs to
+    the `user_id` it claims to act for."""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        data = request.get_json()
+        user_id = user_id_for_email(data.get('val_user_email'))
+        if user_id is None or user_id != data.get('user_id'):
+            return make_response({'error': 'permissions mismatch'}, 400)
+        return method(*args, **kwargs)
+    return wrapper
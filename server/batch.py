@@ -0,0 +1,105 @@
+# Remote library imports
+from sqlalchemy import insert
+
+# Local imports
+from config import db
+from search import index_rows
+
+MAX_BATCH = 2000
+# batches handed to the job worker do not hold up a request, so may be larger
+MAX_ASYNC_BATCH = 20_000
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def batch_items(data, key='items', limit=None, updates=False):
+    """The list under `key`, checked for size. `ids` must all be integers;
+    with `updates`, every item must be an object with an integer id."""
+    limit = limit or MAX_BATCH
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        raise BatchError(f'{key} must be a non-empty list.')
+    if len(items) > limit:
+        raise BatchError(f'at most {limit} {key} per batch.')
+    if key == 'ids' and not all(_is_id(id) for id in items):
+        raise BatchError('ids must be integers.')
+    if updates:
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not _is_id(item.get('id')):
+                raise BatchError(f'{key}[{index}] must be an object with an integer id.')
+    return items
+
+
+def create_all(model, items, prepare):
+    """Runs every item through the model's validators (FK checks are
+    memoized per session, so repeated parents cost one lookup) and, if all
+    pass, inserts them with a single executemany. Returns (ids, errors);
+    nothing is written when any item fails."""
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            row = prepare(item)
+            model(**row)
+        except Exception as ex:
+            errors.append({'index': index, 'error': ex.__str__()})
+        else:
+            rows.append(row)
+    if errors:
+        return [], errors
+    try:
+        ids = db.session.scalars(insert(model).returning(model.id), rows).all()
+        index_rows(db.session, model, ids)
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        return [], [{'index': None, 'error': ex.__str__()}]
+    return ids, []
+
+
+def update_all(model, items):
+    """Applies `{id, **fields}` items to rows loaded in one query and commits
+    once. Returns (updated objects, errors)."""
+    ids = [item.get('id') for item in items]
+    found = {obj.id: obj for obj in model.query.filter(model.id.in_(ids)).all()}
+    updated, errors = [], []
+    for index, item in enumerate(items):
+        obj = found.get(item.get('id'))
+        if obj is None:
+            errors.append({'index': index, 'error': f"{model.__name__} {item.get('id')} not found"})
+            continue
+        try:
+            for attr in item:
+                if attr != 'id':
+                    setattr(obj, attr, item[attr])
+        except Exception as ex:
+            errors.append({'index': index, 'error': ex.__str__()})
+        else:
+            updated.append(obj)
+    if errors:
+        db.session.rollback()
+        return [], errors
+    try:
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        return [], [{'index': None, 'error': ex.__str__()}]
+    return updated, []
+
+
+def delete_all(model, ids):
+    """Deletes rows by id in one transaction; their children go with them
+    through ON DELETE CASCADE without being loaded."""
+    found = model.query.filter(model.id.in_(ids)).all()
+    missing = set(ids) - {obj.id for obj in found}
+    if missing:
+        return 0, [{'id': id, 'error': f'{model.__name__} {id} not found'} for id in sorted(missing)]
+    for obj in found:
+        db.session.delete(obj)
+    db.session.commit()
+    return len(found), []
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# Load test of the REST API. Seeds a dataset of the given size, then runs a
+# mix of scenarios from concurrent threads, either in-process through the
+# Flask test client or over HTTP against a local Gunicorn. Reports p50/p95/p99
+# latency, throughput and SQL statements per request per scenario, and writes
+# the numbers to JSON so a later run can be compared against them.
+#
+#   python -m benchmarks.bench_api --users 1000 --concurrency 8 --duration 20
+#   python -m benchmarks.bench_api --driver gunicorn --gunicorn-workers 4 --out base.json
+#   python -m benchmarks.bench_api --reuse --compare base.json
+#
+# Point DATABASE_URI at a Postgres database to run against Postgres.
+
+# Standard library imports
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Remote library imports
+from sqlalchemy.engine import make_url
+
+# Local imports
+from benchmarks.common import app, db, reset_db
+from benchmarks.query_count import count_queries
+from models import User, City, Location
+from seeding import Profile, seed
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SERVER_DIR, 'benchmarks', 'results')
+SAMPLE = 5000
+
+
+###################### DRIVERS ######################
+
+class ClientDriver:
+    """In-process: one Flask test client per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, len(response.get_data())
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    """Starts `gunicorn app:app` (or another app and worker class) on a
+    local port; one keep-alive connection per thread."""
+
+    def __init__(self, workers, port, app_spec='app:app', worker_class='sync'):
+        self.port = port
+        self._local = threading.local()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+             '-k', worker_class, '--log-level', 'warning', app_spec],
+            cwd=SERVER_DIR, env=os.environ.copy())
+        deadline = time.time() + 30
+        while True:
+            try:
+                self.request('GET', '/')
+                return
+            except OSError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError('gunicorn did not come up')
+                time.sleep(0.2)
+
+    def request(self, method, path, body=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self._local.conn = None
+            conn.close()
+            raise
+        return response.status, len(data)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+###################### SCENARIOS ######################
+
+class Dataset:
+    """Ids sampled from the seeded tables. Cities of the last tenth of the
+    users are reserved for deletes so no other scenario trips over them."""
+
+    def __init__(self):
+        with app.app_context():
+            users = db.session.query(User.id, User.email).order_by(User.id).all()
+            cut = max(1, len(users) * 9 // 10)
+            self.users = random.sample(users[:cut], min(SAMPLE, cut))
+            user_ids = [id for id, _ in self.users]
+            self.emails = dict(self.users)
+            self.cities = db.session.query(City.id, City.user_id).filter(
+                City.user_id.in_(user_ids)).limit(SAMPLE).all()
+            self.locations = db.session.query(Location.id, Location.user_id).filter(
+                Location.user_id.in_(user_ids)).limit(SAMPLE).all()
+            doomed = db.session.query(City.id, City.user_id, User.email).join(User).filter(
+                City.user_id > users[cut - 1][0]).all()
+        random.shuffle(doomed)
+        self.doomed = doomed
+        self.lock = threading.Lock()
+
+    def next_doomed(self):
+        with self.lock:
+            return self.doomed.pop() if self.doomed else None
+
+
+def login(driver, data, rng):
+    _, email = rng.choice(data.users)
+    return driver.request('POST', '/login', {'email': email}), (200,)
+
+
+def list_cities(driver, data, rng):
+    user_id, _ = rng.choice(data.users)
+    return driver.request('GET', f'/cities?user_id={user_id}&limit=20'), (200, 404)
+
+
+def open_city(driver, data, rng):
+    city_id, _ = rng.choice(data.cities)
+    return driver.request('GET', f'/cities/{city_id}'), (200,)
+
+
+def add_location(driver, data, rng):
+    city_id, user_id = rng.choice(data.cities)
+    return driver.request('POST', '/locations', {
+        'val_user_email': data.emails[user_id], 'user_id': user_id, 'city_id': city_id,
+        'location_name': f'Bench {rng.random():.6f}', 'category': 'FoodDrink', 'avg_cost': 1,
+        'google_map_url': None, 'website': None, 'date_visited': None, 'rating': 4,
+    }), (201,)
+
+
+def add_note(driver, data, rng):
+    location_id, user_id = rng.choice(data.locations)
+    return driver.request('POST', '/locationnotes', {
+        'val_user_email': data.emails[user_id], 'user_id': user_id,
+        'location_id': location_id, 'note_body': 'benchmark note',
+    }), (201,)
+
+
+def delete_city(driver, data, rng):
+    doomed = data.next_doomed()
+    if doomed is None:
+        return None, ()
+    city_id, user_id, email = doomed
+    return driver.request('DELETE', f'/cities/{city_id}',
+                          {'val_user_email': email, 'user_id': user_id}), (200,)
+
+
+# scenario -> weight in the mix
+SCENARIOS = {
+    login: 10,
+    list_cities: 30,
+    open_city: 30,
+    add_location: 15,
+    add_note: 10,
+    delete_city: 5,
+}
+
+
+###################### RUN ######################
+
+def run(driver, data, concurrency, duration, seed_value, mix=SCENARIOS):
+    samples = {scenario.__name__: [] for scenario in mix}
+    errors = {scenario.__name__: 0 for scenario in mix}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    scenarios, weights = list(mix), list(mix.values())
+
+    def worker(n):
+        rng = random.Random(seed_value + n)
+        local = {name: [] for name in samples}
+        local_errors = dict.fromkeys(samples, 0)
+        while time.perf_counter() < stop_at:
+            scenario = rng.choices(scenarios, weights)[0]
+            start = time.perf_counter()
+            try:
+                result, expected = scenario(driver, data, rng)
+            except OSError:
+                result, expected = (0, 0), ()
+            if result is None:
+                continue
+            local[scenario.__name__].append(time.perf_counter() - start)
+            if result[0] not in expected:
+                local_errors[scenario.__name__] += 1
+        with lock:
+            for name in samples:
+                samples[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, time.perf_counter() - start
+
+
+def queries_per_request(data, rounds=5):
+    """SQL statements per scenario in steady state, counted in-process one
+    request at a time so the number is the same whichever driver produced
+    the latencies. Each measured request is replayed after an identical
+    warm-up one, so the email and response caches are warm either way."""
+    driver, counts = ClientDriver(), {}
+    for scenario in SCENARIOS:
+        if scenario is delete_city:
+            continue
+        runs = []
+        for n in range(rounds):
+            scenario(driver, data, random.Random(n))
+            with count_queries() as statements:
+                scenario(driver, data, random.Random(n))
+            runs.append(len(statements))
+        counts[scenario.__name__] = sum(runs) / len(runs)
+    # deletes can't be replayed: warm up on another city of the same user
+    with data.lock:
+        by_user = {}
+        for doomed in data.doomed:
+            by_user.setdefault(doomed[1], []).append(doomed)
+        pair = next((cities[:2] for cities in by_user.values() if len(cities) >= 2), None)
+    if pair:
+        for n, doomed in enumerate(pair):
+            data.doomed.remove(doomed)
+            data.doomed.append(doomed)
+            with count_queries() as statements:
+                delete_city(driver, data, None)
+            if n:
+                counts['delete_city'] = len(statements)
+    return counts
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))] * 1000
+
+
+def summarize(samples, errors, elapsed, queries):
+    scenarios = {}
+    for name, values in samples.items():
+        values.sort()
+        scenarios[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.50),
+            'p95_ms': percentile(values, 0.95),
+            'p99_ms': percentile(values, 0.99),
+            'queries': queries.get(name),
+        }
+    everything = sorted(value for values in samples.values() for value in values)
+    total = {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'rps': len(everything) / elapsed,
+        'p50_ms': percentile(everything, 0.50),
+        'p95_ms': percentile(everything, 0.95),
+        'p99_ms': percentile(everything, 0.99),
+    }
+    return scenarios, total
+
+
+def print_table(scenarios, total):
+    def fmt(value):
+        return f'{value:>9.2f}' if value is not None else f'{"-":>9}'
+    print(f'{"scenario":<14} {"requests":>9} {"errors":>7} {"rps":>9} {"p50 ms":>9} '
+          f'{"p95 ms":>9} {"p99 ms":>9} {"queries":>8}')
+    for name, row in {**scenarios, 'total': total}.items():
+        queries = row.get('queries')
+        print(f'{name:<14} {row["requests"]:>9} {row["errors"]:>7} {row["rps"]:>9.1f} '
+              f'{fmt(row["p50_ms"])} {fmt(row["p95_ms"])} {fmt(row["p99_ms"])} '
+              f'{queries if queries is not None else "-":>8}')
+
+
+def compare(current, baseline_path, tolerance):
+    """Prints p95 and query deltas against a saved run; returns the
+    regressions (p95 more than `tolerance` slower, or more queries)."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f'\nvs {baseline_path} ({baseline["meta"]["started_at"]})')
+    for name, row in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base or row['p95_ms'] is None or base['p95_ms'] is None:
+            continue
+        change = row['p95_ms'] / base['p95_ms'] - 1
+        flags = []
+        if change > tolerance:
+            flags.append('p95')
+        if row['queries'] is not None and base['queries'] is not None and row['queries'] > base['queries']:
+            flags.append('queries')
+        if flags:
+            regressions.append((name, flags))
+        print(f'{name:<14} p95 {base["p95_ms"]:>8.2f} -> {row["p95_ms"]:>8.2f} ms ({change:+.0%})   '
+              f'queries {base["queries"]} -> {row["queries"]}'
+              f'{"   REGRESSION: " + ", ".join(flags) if flags else ""}')
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--cities-per-user', type=int, default=10)
+    parser.add_argument('--locations-per-city', type=int, default=10)
+    parser.add_argument('--reuse', action='store_true', help='keep the existing dataset')
+    parser.add_argument('--driver', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--gunicorn-workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='results file (default: benchmarks/results/api-<time>.json)')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    profile = Profile(args.users, args.cities_per_user, args.locations_per_city)
+    if not args.reuse:
+        reset_db()
+        seed(url, profile, rng_seed=args.seed)
+    data = Dataset()
+
+    started_at = datetime.now(timezone.utc)
+    driver = ClientDriver() if args.driver == 'client' else GunicornDriver(args.gunicorn_workers, args.port)
+    try:
+        samples, errors, elapsed = run(driver, data, args.concurrency, args.duration, args.seed)
+    finally:
+        driver.close()
+    queries = queries_per_request(data)
+    scenarios, total = summarize(samples, errors, elapsed, queries)
+    print_table(scenarios, total)
+
+    result = {
+        'meta': {
+            'started_at': started_at.isoformat(),
+            'revision': git_revision(),
+            'database': make_url(url).get_backend_name(),
+            'driver': args.driver,
+            'gunicorn_workers': args.gunicorn_workers if args.driver == 'gunicorn' else None,
+            'concurrency': args.concurrency,
+            'duration_s': elapsed,
+            'profile': vars(profile),
+        },
+        'scenarios': scenarios,
+        'total': total,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f'api-{started_at:%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nwrote {out}')
+
+    if args.compare and compare(result, args.compare, args.tolerance):
+        sys.exit(1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Throughput as concurrency grows: the Gunicorn sync deployment (app.py)
+# against the ASGI entry point (asgi.py on Uvicorn workers), the same number
+# of worker processes each, over the read scenarios of bench_api. A sync
+# worker serves one request at a time, so its throughput stops growing once
+# every worker is busy; an async worker keeps taking requests while others
+# wait on the database, up to its connection pool.
+#
+#   python -m benchmarks.bench_asgi --users 200 --levels 1,4,16,64
+#   python -m benchmarks.bench_asgi --db-latency-ms 5     # a remote database
+#
+# Needs uvicorn and aiosqlite (asyncpg when DATABASE_URI is Postgres).
+
+# Standard library imports
+import argparse
+import os
+import random
+
+# Local imports
+from benchmarks.common import app, reset_db
+from benchmarks.bench_api import Dataset, GunicornDriver, run, summarize, list_cities, open_city, login
+from seeding import Profile, seed
+
+READS = {login: 10, list_cities: 30, open_city: 30}
+MODES = {
+    'sync': ('benchmarks.latency_app:wsgi_app', 'sync'),
+    'asgi': ('benchmarks.latency_app:asgi_app', 'uvicorn.workers.UvicornWorker'),
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cities-per-user', type=int, default=10)
+    parser.add_argument('--locations-per-city', type=int, default=10)
+    parser.add_argument('--reuse', action='store_true', help='keep the existing dataset')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--levels', default='1,4,16,64', help='comma-separated client concurrency')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--db-latency-ms', type=float, default=0,
+                        help='delay added to every SQL statement in the server')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if not args.reuse:
+        reset_db()
+        seed(app.config['SQLALCHEMY_DATABASE_URI'],
+             Profile(args.users, args.cities_per_user, args.locations_per_city),
+             rng_seed=args.seed, report=lambda line: None)
+    data = Dataset()
+    os.environ['BENCH_DB_LATENCY_MS'] = str(args.db_latency_ms)
+    levels = [int(level) for level in args.levels.split(',')]
+
+    results = {}
+    for mode, (app_spec, worker_class) in MODES.items():
+        driver = GunicornDriver(args.workers, args.port, app_spec, worker_class)
+        try:
+            for concurrency in levels:
+                samples, errors, elapsed = run(driver, data, concurrency, args.duration, args.seed, READS)
+                results[mode, concurrency] = summarize(samples, errors, elapsed, {})[1]
+        finally:
+            driver.close()
+
+    print(f'{args.workers} workers each, {args.db_latency_ms:g} ms added per statement')
+    print(f'{"clients":>8} ' + ' '.join(f'{mode + " rps":>10} {"p95 ms":>8} {"errors":>6}' for mode in MODES)
+          + f' {"asgi/sync":>10}')
+    for concurrency in levels:
+        row = [results[mode, concurrency] for mode in MODES]
+        print(f'{concurrency:>8} ' + ' '.join(f'{r["rps"]:>10.1f} {r["p95_ms"] or 0:>8.1f} {r["errors"]:>6}' for r in row)
+              + f' {row[1]["rps"] / row[0]["rps"] if row[0]["rps"] else 0:>9.2f}x')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# DELETE /users/<id> and /cities/<id> against the number of descendants.
+# With ON DELETE CASCADE and passive_deletes the ORM never loads the
+# children, so peak Python memory stays flat as the subtree grows and the
+# time is the database's own cascade. Also checks nothing is left behind:
+# rows, search documents or cached payloads.
+#
+#   python -m benchmarks.bench_cascade_delete --descendants 100000
+
+# Standard library imports
+import argparse
+import tracemalloc
+
+# Local imports
+from benchmarks.common import app, db, reset_db, Timer
+from models import User, City, CityNote, Location, LocationNote
+from search import backend
+from seeding import Profile, seed
+
+TABLES = (City, CityNote, Location, LocationNote)
+
+
+def remaining(user_id):
+    with app.app_context():
+        rows = {
+            'cities': City.query.filter_by(user_id=user_id).count(),
+            'locations': Location.query.filter_by(user_id=user_id).count(),
+        }
+        conn = db.session.connection()
+        rows['search_documents'] = conn.execute(db.text('SELECT COUNT(*) FROM search_documents')).scalar()
+        return rows
+
+
+def delete(client, path, user_id, email):
+    body = {'val_user_email': email, 'user_id': user_id}
+    client.get(path)  # cache the payload so its invalidation is exercised
+    tracemalloc.start()
+    with Timer() as t:
+        response = client.delete(path, json=body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert client.get(path).status_code == 404, f'{path} still served after delete'
+    return t.elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--descendants', type=int, default=100_000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    print(f'{"target":<10} {"descendants":>12} {"time s":>8} {"peak MiB":>9}')
+    for size in sorted({args.descendants // 10, args.descendants}):
+        # users with 11 cities; each city has 2 notes and each location 2 notes.
+        # One city is deleted on its own, the user then takes the other 10.
+        locations_per_city = max(1, (size // 10 - 3) // 3)
+        city_size = 3 + locations_per_city * 3
+        reset_db()
+        seed(app.config['SQLALCHEMY_DATABASE_URI'],
+             Profile(2, 11, locations_per_city, notes_per_city=2, notes_per_location=2),
+             report=lambda line: None)
+        with app.app_context():
+            user = db.session.get(User, 1)
+            user_id, email = user.id, user.email
+            city_id = City.query.filter_by(user_id=user_id).first().id
+
+        elapsed, peak = delete(client, f'/cities/{city_id}', user_id, email)
+        print(f'{"city":<10} {city_size - 1:>12,} {elapsed:>8.2f} {peak / 2 ** 20:>9.1f}')
+        elapsed, peak = delete(client, f'/users/{user_id}', user_id, email)
+        print(f'{"user":<10} {10 * city_size:>12,} {elapsed:>8.2f} {peak / 2 ** 20:>9.1f}')
+
+        left = remaining(user_id)
+        assert left['cities'] == 0 and left['locations'] == 0, left
+        # only the other user's documents remain (every seeded row is indexed)
+        with app.app_context():
+            other = sum(db.session.query(model).count() for model in TABLES)
+        assert left['search_documents'] == other, (left, other)
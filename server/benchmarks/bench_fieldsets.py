@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Full payloads against sparse fieldsets (?fields= / ?include=) of the same
+# rows: time per request, response size and SQL statements. The sparse
+# views should do less work in the database and in serialization, not just
+# send less JSON. The response cache is bypassed so every read builds the
+# payload.
+#
+#   python -m benchmarks.bench_fieldsets --locations-per-city 50
+
+# Standard library imports
+import argparse
+import statistics
+
+# Local imports
+from benchmarks.common import app, reset_db, Timer
+from benchmarks.query_count import count_queries
+from cache import response_cache
+from seeding import Profile, seed
+
+READS = 30
+CASES = (
+    ('/users/1', 'fields=id,username'),
+    ('/users/1', 'fields=username,cities.city_name,cities.country'),
+    ('/cities?limit=100', 'fields=id,city_name,country'),
+    ('/cities?limit=100', 'fields=city_name,locations.location_name,locations.rating'),
+    ('/locations?limit=500', 'fields=id,location_name,rating'),
+    ('/citynotes?limit=200', 'fields=note_body,note_type'),
+)
+
+
+def measure(client, path):
+    times = []
+    for _ in range(READS):
+        response_cache.invalidate({'user:1', 'city:1', 'location:1'})
+        with count_queries() as statements:
+            with Timer() as t:
+                response = client.get(path)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        times.append(t.elapsed)
+    return statistics.median(times) * 1000, len(response.get_data()), len(statements)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--locations-per-city', type=int, default=50)
+    args = parser.parse_args()
+
+    reset_db()
+    seed(app.config['SQLALCHEMY_DATABASE_URI'],
+         Profile(10, 20, args.locations_per_city, notes_per_city=2, notes_per_location=2),
+         report=lambda line: None)
+    client = app.test_client()
+    print(f'{"request":<80} {"ms":>8} {"bytes":>10} {"stmts":>6}')
+    for path, sparse in CASES:
+        for url in (path, f'{path}{"&" if "?" in path else "?"}{sparse}'):
+            ms, size, statements = measure(client, url)
+            print(f'{url:<80} {ms:>8.2f} {size:>10,} {statements:>6}')
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Insert latency vs. table size for the FK validators in models.py.
+# Each size rebuilds users/cities/locations with that many rows, then times
+# ORM inserts of new Locations and LocationNotes (which run the validators).
+#
+#   python -m benchmarks.bench_fk_validators --sizes 1000 10000 100000 1000000
+
+# Standard library imports
+import argparse
+import statistics
+
+# Local imports
+from benchmarks.common import app, db, reset_db, bulk_rows, Timer
+from models import Location, LocationNote
+
+
+def time_inserts(n_rows, repeat):
+    samples = []
+    with app.app_context():
+        for i in range(repeat):
+            with Timer() as t:
+                loc = Location(location_name=f'bench {i}', category='Other',
+                               user_id=(i % n_rows) + 1, city_id=(i % n_rows) + 1)
+                db.session.add(loc)
+                db.session.flush()
+                db.session.add(LocationNote(note_body='bench', location_id=loc.id))
+                db.session.commit()
+            samples.append(t.elapsed * 1000)
+    return samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        reset_db()
+        bulk_rows(size)
+        samples = sorted(time_inserts(size, args.repeat))
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        print(f'{size:>10} {statistics.median(samples):>8.3f} {p95:>8.3f}')
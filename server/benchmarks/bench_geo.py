@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# /locations/within and /locations/near latency against the table size.
+# Scatters locations over a 10x10 degree area, then times boxes and radii of
+# fixed size: latency should follow the number of hits, not the row count.
+#
+#   python -m benchmarks.bench_geo --locations 1000000
+
+# Standard library imports
+import argparse
+import random
+import statistics
+
+# Local imports
+from benchmarks.common import app, db, reset_db, bulk_rows, Timer
+from models import Location
+from geo import encode
+
+QUERIES = (
+    '/locations/within?bbox=125.00,35.00,125.05,35.05&limit=500',
+    '/locations/within?bbox=125.0,35.0,125.5,35.5&limit=500',
+    '/locations/near?lat=37.5&lng=127.0&radius=2000&limit=500',
+    '/locations/near?lat=37.5&lng=127.0&radius=20000&limit=50',
+)
+
+
+def scatter(n_locations, chunk=50_000):
+    with app.app_context():
+        rows = []
+        for id in range(1, n_locations + 1):
+            lat, lng = 33 + random.random() * 10, 122 + random.random() * 10
+            rows.append({'b_id': id, 'lat': lat, 'lng': lng, 'geohash': encode(lat, lng)})
+            if len(rows) >= chunk:
+                db.session.execute(_update(), rows)
+                rows = []
+        if rows:
+            db.session.execute(_update(), rows)
+        db.session.commit()
+
+
+def _update():
+    table = Location.__table__
+    return table.update().where(table.c.id == db.bindparam('b_id')).values(
+        lat=db.bindparam('lat'), lng=db.bindparam('lng'), geohash=db.bindparam('geohash'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--locations', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    random.seed(0)
+    reset_db()
+    _, _, n_locations = bulk_rows(100, cities_per_user=10,
+                                  locations_per_city=max(1, args.locations // 1000))
+    scatter(n_locations)
+    print(f'{n_locations} locations')
+
+    client = app.test_client()
+    for query in QUERIES:
+        samples = []
+        for _ in range(args.repeat):
+            with Timer() as t:
+                response = client.get(query)
+            samples.append(t.elapsed * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        samples.sort()
+        print(f'{query:<62} hits {len(response.json["data"]):>4}   '
+              f'p50 {statistics.median(samples):>8.2f} ms   '
+              f'p95 {samples[int(len(samples) * 0.95) - 1]:>8.2f} ms')
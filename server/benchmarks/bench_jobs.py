@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Background jobs on SQLite with no broker: how long a request for a large
+# cascading delete holds a worker synchronously vs. when it is queued, then
+# that the queue drains, retries with backoff, gives up after max_attempts
+# and keeps each kind under its concurrency limit across workers.
+#
+#   python -m benchmarks.bench_jobs --descendants 100000
+
+# Standard library imports
+import argparse
+import threading
+import time
+
+# Local imports
+from benchmarks.common import app, db, reset_db, Timer
+from models import User, City, Job
+from seeding import Profile, seed
+import jobs
+from jobs import Worker, enqueue, job
+
+flaky_calls = {}
+running = {'now': 0, 'max': 0}
+running_lock = threading.Lock()
+
+
+@job('bench_flaky', max_attempts=3)
+def flaky(payload):
+    calls = flaky_calls[payload['name']] = flaky_calls.get(payload['name'], 0) + 1
+    if calls <= payload['fail_times']:
+        raise RuntimeError(f'attempt {calls} fails')
+    return {'calls': calls}
+
+
+@job('bench_limited', concurrency=2)
+def limited(payload):
+    with running_lock:
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+    time.sleep(payload['seconds'])
+    with running_lock:
+        running['now'] -= 1
+    return {}
+
+
+def drain(*workers):
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    with Timer() as t:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return t.elapsed
+
+
+def status(client, job_id):
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def delete_user(client, user_id, email, run_async):
+    path = f'/users/{user_id}' + ('?async=1' if run_async else '')
+    with Timer() as t:
+        response = client.delete(path, json={'val_user_email': email, 'user_id': user_id})
+    assert response.status_code == (202 if run_async else 200), response.get_data(as_text=True)
+    return t.elapsed, response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--descendants', type=int, default=100_000)
+    args = parser.parse_args()
+    jobs.BACKOFF_SECONDS = 0.05
+
+    reset_db()
+    locations_per_city = max(1, (args.descendants // 10 - 3) // 3)
+    seed(app.config['SQLALCHEMY_DATABASE_URI'],
+         Profile(3, 10, locations_per_city, notes_per_city=2, notes_per_location=2),
+         report=lambda line: None)
+    client = app.test_client()
+    with app.app_context():
+        users = [(user.id, user.email) for user in User.query.order_by(User.id)]
+
+    sync_seconds, _ = delete_user(client, *users[0], run_async=False)
+    async_seconds, response = delete_user(client, *users[1], run_async=True)
+    job_id = response.get_json()['job_id']
+    assert response.headers['Location'].endswith(f'/jobs/{job_id}')
+    assert status(client, job_id)['status'] == 'queued'
+    drained = drain(Worker(concurrency=2, poll=0.01, burst=True))
+    finished = status(client, job_id)
+    assert finished['status'] == 'succeeded' and finished['result'] == {'deleted': True}, finished
+    assert client.get(f'/users/{users[1][0]}').status_code == 404
+    print(f'DELETE /users/<id> with ~{args.descendants:,} descendants')
+    print(f'  synchronous      {sync_seconds * 1000:>9.1f} ms in the request')
+    print(f'  queued (202)     {async_seconds * 1000:>9.1f} ms in the request, '
+          f'{drained * 1000:.1f} ms in the worker')
+
+    with app.app_context():
+        retried = enqueue('bench_flaky', {'name': 'retried', 'fail_times': 2}).id
+        failed = enqueue('bench_flaky', {'name': 'failed', 'fail_times': 10}).id
+    drain(Worker(poll=0.01, burst=True))
+    retried, failed = status(client, retried), status(client, failed)
+    assert retried['status'] == 'succeeded' and retried['attempts'] == 3, retried
+    assert failed['status'] == 'failed' and failed['attempts'] == 3, failed
+    print(f'  retries          succeeded on attempt 3; gave up after 3 ({failed["error"]})')
+
+    with app.app_context():
+        ids = [enqueue('bench_limited', {'seconds': 0.2}).id for _ in range(8)]
+    elapsed = drain(Worker(concurrency=4, poll=0.01, burst=True), Worker(concurrency=4, poll=0.01, burst=True))
+    assert all(status(client, id)['status'] == 'succeeded' for id in ids)
+    assert running['max'] == 2, running
+    print(f'  concurrency      8 jobs of 0.2 s on 8 threads, limit 2: at most {running["max"]} at once, '
+          f'{elapsed:.2f} s')
+
+    # an invalid item fails the import at once instead of being retried
+    with app.app_context():
+        city = City.query.first()
+        user = db.session.get(User, city.user_id)
+        body = {'val_user_email': user.email, 'user_id': user.id,
+                'items': [{'location_name': 'ok', 'category': 'Other', 'city_id': city.id},
+                          {'location_name': 'bad', 'category': 'Nope', 'city_id': city.id}]}
+    response = client.post('/locations:batch?async=1', json=body)
+    assert response.status_code == 202, response.get_data(as_text=True)
+    drain(Worker(poll=0.01, burst=True))
+    rejected = status(client, response.get_json()['job_id'])
+    assert rejected['status'] == 'failed' and rejected['attempts'] == 1, rejected
+    assert rejected['result']['errors'][0]['index'] == 1, rejected
+    with app.app_context():
+        assert Job.query.filter(Job.status.in_(('queued', 'running'))).count() == 0
+    print('  invalid import   failed on attempt 1 with the rejected items as its result')
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Bytes on the wire and encode time for the /users/<id> payload with the old
+# setup (stdlib json, indented) against FastJSONProvider (compact, orjson
+# when installed).
+#
+#   python -m benchmarks.bench_json
+
+# Standard library imports
+import argparse
+import timeit
+
+# Remote library imports
+from flask.json.provider import DefaultJSONProvider
+
+# Local imports
+from benchmarks.common import app, reset_db, bulk_rows
+from json_provider import FastJSONProvider
+from loaders import USER_LOADERS
+from models import User
+from serializers import serialize
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--number', type=int, default=50)
+    args = parser.parse_args()
+
+    reset_db()
+    bulk_rows(1, cities_per_user=args.cities, locations_per_city=args.locations)
+
+    before = DefaultJSONProvider(app)
+    before.compact = False
+    after = FastJSONProvider(app)
+
+    with app.app_context():
+        payload = serialize(User.query.options(*USER_LOADERS).filter_by(id=1).first())
+        for label, provider in (('before', before), ('after', after)):
+            size = len(provider.response(payload).get_data())
+            seconds = timeit.timeit(lambda: provider.response(payload), number=args.number)
+            print(f'{label:<7} {size:>9} bytes {seconds / args.number * 1000:>8.3f} ms')
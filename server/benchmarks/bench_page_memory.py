@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Peak memory of one `/locations?limit=` page as the table grows. With keyset
+# pagination the peak should stay flat regardless of total row count. With
+# --stream the whole table is exported as NDJSON instead, which should stay
+# flat as well.
+#
+#   python -m benchmarks.bench_page_memory --sizes 1000 10000 100000 [--stream]
+
+# Standard library imports
+import argparse
+import tracemalloc
+
+# Local imports
+from benchmarks.common import app, reset_db, bulk_rows
+
+
+def page_peak_kb(path):
+    client = app.test_client()
+    client.get(path)  # warm up imports and compiled statements
+    tracemalloc.start()
+    response = client.get(path)
+    for _ in response.response:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert response.status_code == 200, response.status_code
+    return peak / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'peak KiB':>10}")
+    for size in args.sizes:
+        reset_db()
+        bulk_rows(size)
+        if args.stream:
+            path = '/locations?stream=1'
+        else:
+            path = f'/locations?limit={args.limit}&after={size // 2}'
+        peak = page_peak_kb(path)
+        print(f'{size:>10} {peak:>10.1f}')
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# /search latency against the index size. Fills locationNotes with random
+# word salad, rebuilds the index, then times ranked first-page queries for
+# common and rare terms.
+#
+#   python -m benchmarks.bench_search --notes 1000000
+
+# Standard library imports
+import argparse
+import random
+import statistics
+
+# Local imports
+from benchmarks.common import app, db, reset_db, bulk_rows, Timer
+from models import LocationNote
+from search import backend
+
+WORDS = ('subway bus taxi temple park market museum coffee noodle kimbap night view '
+         'river bridge tower palace hike beach sunset street food cheap pricey crowded '
+         'quiet tram ferry bakery gallery festival castle harbor island alley').split()
+QUERIES = ('subway', 'night market', 'castle harbor', 'kimbap cheap', 'festival')
+
+
+def fill_notes(n_notes, n_locations, chunk=50_000):
+    with app.app_context():
+        rows = []
+        for i in range(n_notes):
+            rows.append({'note_body': ' '.join(random.choices(WORDS, k=12)),
+                         'location_id': i % n_locations + 1})
+            if len(rows) >= chunk:
+                db.session.execute(LocationNote.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(LocationNote.__table__.insert(), rows)
+        conn = db.session.connection()
+        backend(conn).rebuild(conn)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(0)
+    reset_db()
+    _, _, n_locations = bulk_rows(100, cities_per_user=10, locations_per_city=10)
+    with Timer() as t:
+        fill_notes(args.notes, n_locations)
+    print(f'indexed {args.notes} notes in {t.elapsed:.1f}s')
+
+    client = app.test_client()
+    for q in QUERIES:
+        samples = []
+        for _ in range(args.repeat):
+            with Timer() as t:
+                response = client.get(f'/search?q={q}&limit=20')
+            samples.append(t.elapsed * 1000)
+        assert response.status_code == 200
+        samples.sort()
+        print(f'{q:<16} p50 {statistics.median(samples):>8.2f} ms   '
+              f'p95 {samples[int(len(samples) * 0.95) - 1]:>8.2f} ms')
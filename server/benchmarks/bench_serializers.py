@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Precompiled serializers (serializers.py) against SerializerMixin.to_dict for
+# the /users/<id> and /cities/<id> payloads of a user with 50 cities x 50
+# locations. Relationships are loaded up front so only serialization is timed.
+#
+#   python -m benchmarks.bench_serializers
+
+# Standard library imports
+import argparse
+import timeit
+
+# Local imports
+from benchmarks.common import app, reset_db, bulk_rows
+from loaders import USER_LOADERS, CITY_LOADERS
+from models import User, City
+from serializers import serialize
+
+
+def compare(label, obj, rules, number):
+    assert serialize(obj, rules) == obj.to_dict(rules=rules), label
+    before = timeit.timeit(lambda: obj.to_dict(rules=rules), number=number) / number
+    after = timeit.timeit(lambda: serialize(obj, rules), number=number) / number
+    print(f'{label:<14} to_dict {before * 1000:>9.3f} ms   '
+          f'compiled {after * 1000:>8.3f} ms   x{before / after:.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    reset_db()
+    bulk_rows(1, cities_per_user=args.cities, locations_per_city=args.locations)
+    with app.app_context():
+        user = User.query.options(*USER_LOADERS).filter_by(id=1).first()
+        city = City.query.options(*CITY_LOADERS).filter_by(id=1).first()
+        compare('/users/<id>', user, (), args.number)
+        compare('/cities/<id>', city, ('-city_imgs',), args.number * 10)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# GET /users/<id>/stats, read from the user_stats tables, against computing
+# the same numbers from the user's full tree (GET /users/<id> plus a count
+# in Python), then a random mix of ORM writes, batch inserts, updates that
+# move rows between users and cascading deletes, after which the stored
+# stats must match a recomputation exactly.
+#
+#   python -m benchmarks.bench_user_stats --locations-per-city 200 --writes 500
+
+# Standard library imports
+import argparse
+import random
+import statistics
+
+# Local imports
+from benchmarks.common import app, db, reset_db, Timer
+from cache import response_cache
+from models import User, City, CityNote, Location, LocationNote
+from seeding import CATEGORIES, Profile, seed
+from stats import drift
+
+READS = 50
+
+
+def latency(client, path, uncached=()):
+    times = []
+    for _ in range(READS):
+        response_cache.invalidate(set(uncached))
+        with Timer() as t:
+            response = client.get(path)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        times.append(t.elapsed)
+    return statistics.median(times) * 1000, response
+
+
+def from_tree(user):
+    """The stats the tree payload implies, to check the endpoint against."""
+    locations = [location for city in user['cities'] for location in city['locations']]
+    return {'cities': len(user['cities']), 'locations': len(locations),
+            'countries': len({city['country'] for city in user['cities']})}
+
+
+def random_write(rng, users):
+    """One transaction of a randomly chosen kind, through the session."""
+    kind = rng.choice(('city', 'location', 'notes', 'batch', 'update', 'move', 'delete'))
+    user_id = rng.choice(users)
+    cities = [id for (id,) in db.session.query(City.id).filter_by(user_id=user_id)]
+    if kind == 'city' or not cities:
+        db.session.add(City(city_name=f'City {rng.random()}', country=f'Country {rng.randrange(20)}',
+                            user_id=user_id))
+    elif kind == 'location':
+        db.session.add(Location(location_name='bench', category=rng.choice(CATEGORIES),
+                                rating=rng.choice((None, 1, 2, 3, 4, 5)),
+                                city_id=rng.choice(cities), user_id=user_id))
+    elif kind == 'notes':
+        city_id = rng.choice(cities)
+        db.session.add(CityNote(note_body='bench', note_type='Other', city_id=city_id))
+        location = db.session.query(Location).filter_by(city_id=city_id).first()
+        if location:
+            db.session.add(LocationNote(note_body='bench', location_id=location.id))
+    elif kind == 'batch':
+        rows = [{'location_name': 'bench', 'category': rng.choice(CATEGORIES + [None]),
+                 'rating': rng.choice((None, 3, 5)), 'city_id': rng.choice(cities), 'user_id': user_id}
+                for _ in range(rng.randrange(1, 20))]
+        db.session.execute(db.insert(Location), rows)
+    elif kind == 'update':
+        for location in db.session.query(Location).filter(Location.city_id.in_(cities)).limit(5):
+            location.rating = rng.choice((None, 1, 5))
+            location.category = rng.choice(CATEGORIES)
+    elif kind == 'move':
+        city = db.session.get(City, rng.choice(cities))
+        city.country = f'Country {rng.randrange(20)}'
+        city.user_id = rng.choice(users)
+        location = db.session.query(Location).filter_by(user_id=user_id).first()
+        if location:
+            location.user_id = rng.choice(users)
+    else:
+        city = db.session.get(City, rng.choice(cities))
+        location = db.session.query(Location).filter(Location.city_id != city.id,
+                                                     Location.user_id == user_id).first()
+        db.session.delete(city)
+        if location:
+            db.session.delete(location)
+    db.session.commit()
+    return kind
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--locations-per-city', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=500)
+    args = parser.parse_args()
+
+    reset_db()
+    seed(app.config['SQLALCHEMY_DATABASE_URI'],
+         Profile(20, 10, args.locations_per_city, notes_per_city=2, notes_per_location=2),
+         report=lambda line: None)
+    client = app.test_client()
+
+    stats_ms, stats = latency(client, '/users/1/stats')
+    # the tree from the database each time, as the stats would be without the table
+    tree_ms, tree = latency(client, '/users/1', uncached={'user:1'})
+    expected = from_tree(tree.get_json())
+    assert {key: stats.get_json()[key] for key in expected} == expected, (stats.get_json(), expected)
+    descendants = 10 * (3 + args.locations_per_city * 3)
+    print(f'user with ~{descendants:,} descendants, median of {READS} reads')
+    print(f'  GET /users/<id>/stats {stats_ms:>9.2f} ms')
+    print(f'  GET /users/<id>       {tree_ms:>9.2f} ms (uncached)')
+
+    rng = random.Random(0)
+    kinds = {}
+    with app.app_context():
+        users = [id for (id,) in db.session.query(User.id)]
+        with Timer() as t:
+            for _ in range(args.writes):
+                kind = random_write(rng, users)
+                kinds[kind] = kinds.get(kind, 0) + 1
+        found = drift(db.session.connection())
+    assert not found, found[:10]
+    print(f'  {args.writes} random writes in {t.elapsed:.1f} s '
+          f'({", ".join(f"{n} {kind}" for kind, n in sorted(kinds.items()))}): no drift')
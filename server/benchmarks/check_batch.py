@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Malformed batch bodies must come back as 400s naming what is wrong, never
+# as 500s from deep inside update_all or delete_all.
+#
+#   python -m benchmarks.check_batch
+
+# Standard library imports
+import sys
+
+# Local imports
+from benchmarks.common import app, reset_db, bulk_rows
+
+OWNER = {'val_user_email': 'user1@bench.io', 'user_id': 1}
+CASES = (
+    ('patch', '/locations:batch', {'items': [1]}, 'items[0]'),
+    ('patch', '/locations:batch', {'items': [{'id': 1, 'rating': 5}, 'x']}, 'items[1]'),
+    ('patch', '/locations:batch', {'items': [{'id': [], 'rating': 5}]}, 'items[0]'),
+    ('patch', '/locations:batch', {'items': [{'id': '1', 'rating': 5}]}, 'items[0]'),
+    ('patch', '/locations:batch', {'items': [{'rating': 5}]}, 'items[0]'),
+    ('patch', '/locationnotes:batch', {'items': [{'id': True, 'note_body': 'x'}]}, 'items[0]'),
+    ('delete', '/locations:batch', {'ids': [[1]]}, 'ids'),
+    ('delete', '/locationnotes:batch', {'ids': [{'id': 1}]}, 'ids'),
+)
+
+
+if __name__ == '__main__':
+    reset_db()
+    bulk_rows(2, cities_per_user=1, locations_per_city=2)
+    client = app.test_client()
+    failed = []
+    for method, path, body, expected in CASES:
+        response = getattr(client, method)(path, json={**OWNER, **body})
+        error = (response.get_json() or {}).get('error', '')
+        ok = response.status_code == 400 and expected in error
+        print(f"{'ok' if ok else 'FAIL':<5} {method.upper()} {path} {body} -> {response.status_code} {error}")
+        if not ok:
+            failed.append(path)
+    # a well-formed batch still goes through
+    response = client.patch('/locations:batch', json={**OWNER, 'items': [{'id': 1, 'rating': 5}]})
+    print(f"{'ok' if response.status_code == 202 else 'FAIL':<5} valid PATCH -> {response.status_code}")
+    if response.status_code != 202:
+        failed.append('valid PATCH')
+    sys.exit(1 if failed else 0)
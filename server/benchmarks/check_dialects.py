@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# Compiles statements that the SQLite benchmarks run for the other dialect
+# the app supports, and fails on SQL that Postgres rejects but SQLite
+# accepts. No Postgres server is needed.
+#
+#   python -m benchmarks.check_dialects
+
+# Standard library imports
+import re
+import sys
+
+# Remote library imports
+from sqlalchemy.dialects import postgresql
+
+# Local imports
+from benchmarks.common import app
+from summary import summary_query
+
+STATEMENTS = {
+    'city summary': summary_query(1),
+}
+# GROUP BY on a literal: "non-integer constant in GROUP BY" on Postgres
+CONSTANT_GROUP_BY = re.compile(r"GROUP BY\s+('|\d)")
+
+
+if __name__ == '__main__':
+    failed = []
+    for name, stmt in STATEMENTS.items():
+        sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        ok = not CONSTANT_GROUP_BY.search(sql)
+        print(f"{'ok' if ok else 'FAIL':<5} {name}")
+        if not ok:
+            print(sql)
+            failed.append(name)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,74 @@
+# Shared setup for the benchmark scripts. Run them from the server directory,
+# e.g. `python -m benchmarks.bench_fk_validators`.
+
+# Standard library imports
+import os
+import tempfile
+import time
+
+# DATABASE_URI has to be in place before config.py builds the app.
+if not os.environ.get('DATABASE_URI'):
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(
+        tempfile.gettempdir(), 'vicariously_bench.db')
+
+# Local imports
+from app import app
+from config import db
+from models import User, City, Location
+
+
+def reset_db():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+
+def bulk_rows(n_users, cities_per_user=1, locations_per_city=1, chunk=50_000):
+    """Fills the tables through Core inserts so building large fixtures does
+    not itself go through the ORM validators being measured."""
+    with app.app_context():
+        rows = []
+        for i in range(1, n_users + 1):
+            rows.append({'id': i, 'email': f'user{i}@bench.io', 'username': f'user{i}'})
+            if len(rows) >= chunk:
+                db.session.execute(User.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(User.__table__.insert(), rows)
+
+        rows, city_id = [], 0
+        for user_id in range(1, n_users + 1):
+            for c in range(cities_per_user):
+                city_id += 1
+                rows.append({'id': city_id, 'city_name': f'City {city_id}',
+                             'country': f'Country {c}', 'user_id': user_id})
+                if len(rows) >= chunk:
+                    db.session.execute(City.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            db.session.execute(City.__table__.insert(), rows)
+
+        rows, loc_id = [], 0
+        for cid in range(1, city_id + 1):
+            user_id = (cid - 1) // cities_per_user + 1
+            for _ in range(locations_per_city):
+                loc_id += 1
+                rows.append({'id': loc_id, 'location_name': f'Location {loc_id}',
+                             'category': 'Other', 'rating': loc_id % 5 + 1,
+                             'avg_cost': loc_id % 4, 'city_id': cid, 'user_id': user_id})
+                if len(rows) >= chunk:
+                    db.session.execute(Location.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            db.session.execute(Location.__table__.insert(), rows)
+        db.session.commit()
+        return n_users, city_id, loc_id
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
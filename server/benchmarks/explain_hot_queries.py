@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Runs EXPLAIN on the queries behind the hot endpoints (relationship loads,
+# cascade lookups, the owner check, list filters) and exits non-zero if any
+# of them would scan a whole table. Point DATABASE_URI at the database to
+# check; on Postgres sequential scans are disabled for the session so the
+# planner only falls back to one when no index can serve the query.
+#
+#   DATABASE_URI=postgresql://... python -m benchmarks.explain_hot_queries
+
+# Standard library imports
+import sys
+
+# Remote library imports
+from sqlalchemy import select, text
+
+# Local imports
+from benchmarks.common import app, db
+from models import User, City, CityNote, Location, LocationNote
+
+HOT_QUERIES = {
+    'owner check (users.email)': select(User.id).where(User.email == 'a@b.com'),
+    'User.cities': select(City).where(City.user_id.in_([1, 2])),
+    'User.locations': select(Location).where(Location.user_id == 1),
+    'City.locations': select(Location).where(Location.city_id.in_([1, 2])),
+    'City.city_notes': select(CityNote).where(CityNote.city_id.in_([1, 2])),
+    'Location.location_notes': select(LocationNote).where(LocationNote.location_id.in_([1, 2])),
+    'locations by city+category': select(Location).where(Location.city_id == 1, Location.category == 'Other'),
+    'locations by user+city': select(Location).where(Location.user_id == 1, Location.city_id == 1),
+    'city notes by city+type': select(CityNote).where(CityNote.city_id == 1, CityNote.note_type == 'Other'),
+    'locations page': select(Location).where(Location.id > 100).order_by(Location.id).limit(50),
+}
+
+
+def explain(conn, stmt):
+    sql = str(stmt.compile(conn, compile_kwargs={'literal_binds': True}))
+    if conn.dialect.name == 'postgresql':
+        plan = conn.execute(text('EXPLAIN ' + sql)).scalars().all()
+        return plan, any('Seq Scan' in line for line in plan)
+    plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    # "SCAN table" without an index is SQLite's full table scan
+    return plan, any(line.startswith('SCAN') and 'USING' not in line for line in plan)
+
+
+if __name__ == '__main__':
+    failed = []
+    with app.app_context():
+        with db.engine.connect() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text('SET enable_seqscan = off'))
+            for name, stmt in HOT_QUERIES.items():
+                plan, seq_scan = explain(conn, stmt)
+                print(f"{'SEQ SCAN' if seq_scan else 'ok':<9} {name}")
+                for line in plan:
+                    print(f'          {line}')
+                if seq_scan:
+                    failed.append(name)
+    if failed:
+        print(f"\n{len(failed)} hot queries fall back to a sequential scan: {', '.join(failed)}")
+        sys.exit(1)
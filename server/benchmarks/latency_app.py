@@ -0,0 +1,36 @@
+# Server entry points for bench_asgi, e.g. `gunicorn benchmarks.latency_app:wsgi_app`.
+# The app is only imported on first access, so the async one can pick its
+# driver before config.py runs. BENCH_DB_LATENCY_MS adds a delay to every SQL
+# statement, standing in for the round trip to a database on another host:
+# time.sleep for the sync engine, an awaited asyncio.sleep for the async one.
+
+# Standard library imports
+import asyncio
+import os
+import time
+
+# Remote library imports
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.util import await_only
+
+LATENCY_SECONDS = float(os.environ.get('BENCH_DB_LATENCY_MS', 0)) / 1000
+
+
+def delay_statement(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.is_async:
+        await_only(asyncio.sleep(LATENCY_SECONDS))
+    else:
+        time.sleep(LATENCY_SECONDS)
+
+
+def __getattr__(name):
+    if name == 'wsgi_app':
+        from app import app as served
+    elif name == 'asgi_app':
+        from asgi import app as served
+    else:
+        raise AttributeError(name)
+    if LATENCY_SECONDS and not event.contains(Engine, 'before_cursor_execute', delay_statement):
+        event.listen(Engine, 'before_cursor_execute', delay_statement)
+    return served
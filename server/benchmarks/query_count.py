@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Query budgets per endpoint. `count_queries()` counts the SQL statements run
+# inside its block; `assert_max_queries()` fails when a request goes over its
+# budget. Running the module checks the budgets below against a fixture whose
+# size should not matter to the counts.
+#
+#   python -m benchmarks.query_count
+
+# Standard library imports
+from contextlib import contextmanager
+
+# Remote library imports
+from sqlalchemy import event
+
+# Local imports
+from benchmarks.common import app, db, reset_db, bulk_rows
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def assert_max_queries(client, path, max_queries, method='get', **kwargs):
+    with count_queries() as statements:
+        response = getattr(client, method)(path, **kwargs)
+    assert len(statements) <= max_queries, (
+        f'{method.upper()} {path} ran {len(statements)} queries '
+        f'(budget {max_queries}):\n' + '\n'.join(statements))
+    return response
+
+
+# endpoint -> max statements, independent of how many rows hang off it.
+# Detail endpoints include the version (ETag) query.
+BUDGETS = {
+    '/users/1': 5,
+    '/users?limit=20': 4,
+    '/cities/1': 5,
+    '/cities?limit=20': 4,
+    '/citynotes?limit=20': 3,
+    '/locations/1': 3,
+    '/locations?limit=20': 2,
+    '/locationnotes?limit=20': 1,
+    # sparse views load only the relationships they show
+    '/users/1?fields=id,username': 2,
+    '/cities?limit=20&fields=id,city_name': 1,
+    '/cities?limit=20&fields=city_name&include=locations': 3,
+    '/citynotes?limit=20&fields=note_body': 1,
+    '/locations/1?fields=rating': 2,
+}
+
+# POST endpoint -> (body, max statements) for single-row writes, stats
+# upkeep included: only the tables a write touches are aggregated.
+WRITE_BUDGETS = {
+    '/locations': ({'val_user_email': 'user1@bench.io', 'user_id': 1, 'city_id': 1,
+                    'location_name': 'budget', 'category': 'FoodDrink', 'avg_cost': 1,
+                    'google_map_url': None, 'website': None, 'date_visited': None, 'rating': 4}, 12),
+    '/locationnotes': ({'val_user_email': 'user1@bench.io', 'user_id': 1, 'location_id': 1,
+                        'note_body': 'budget'}, 7),
+}
+
+
+if __name__ == '__main__':
+    reset_db()
+    bulk_rows(50, cities_per_user=10, locations_per_city=10)
+    with app.app_context():
+        db.session.execute(db.text(
+            "INSERT INTO cityNotes (note_body, note_type, city_id) "
+            "SELECT 'note', 'Other', id FROM cities"))
+        db.session.execute(db.text(
+            'INSERT INTO "locationNotes" (note_body, location_id) '
+            "SELECT 'note', id FROM locations"))
+        db.session.commit()
+    client = app.test_client()
+    for path, budget in BUDGETS.items():
+        with count_queries() as statements:
+            response = client.get(path)
+        status = 'ok' if len(statements) <= budget else 'OVER BUDGET'
+        print(f'{path:<54} {response.status_code} {len(statements):>3} / {budget:<3} {status}')
+    for path, (body, budget) in WRITE_BUDGETS.items():
+        with count_queries() as statements:
+            response = client.post(path, json=body)
+        status = 'ok' if len(statements) <= budget else 'OVER BUDGET'
+        print(f'{"POST " + path:<54} {response.status_code} {len(statements):>3} / {budget:<3} {status}')
+    for path, budget in BUDGETS.items():
+        assert_max_queries(client, path, budget)
+    for path, (body, budget) in WRITE_BUDGETS.items():
+        assert_max_queries(client, path, budget, method='post', json=body)
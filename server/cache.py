@@ -0,0 +1,267 @@
+# Standard library imports
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+# Remote library imports
+from flask import current_app, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+# Local imports
+from models import User, City, CityNote, Location, LocationNote
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - only needed for the shared backend
+    redis = None
+
+
+###################### BACKENDS ######################
+
+class LRUBackend:
+    """In-process cache. Every entry carries the tags of the rows its
+    payload was built from; invalidating a tag drops those entries."""
+
+    def __init__(self, maxsize=2048, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] > self.ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, body, tags, etag=None):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (body, time.time(), tags, etag)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.pop(tag, set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared cache for running several workers; tags are redis sets of
+    cache keys."""
+
+    def __init__(self, url, ttl=300, prefix='vicariously:'):
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE_URL is set but redis is not installed.')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, body, tags, etag=None):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, pickle.dumps((body, time.time(), tags, etag)), ex=self.ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + 'tag:' + tag, key)
+            pipe.expire(self.prefix + 'tag:' + tag, self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [self.prefix + 'tag:' + tag for tag in tags]
+        keys = self.client.sunion(tag_keys) if tag_keys else set()
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.delete(self.prefix + key.decode())
+        pipe.delete(*tag_keys)
+        pipe.execute()
+        return len(keys)
+
+    def size(self):
+        # counting the keys would take KEYS/SCAN over a shared server on
+        # every scrape, and entries expire without telling us; not reported
+        return None
+
+
+###################### RESPONSE CACHE ######################
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.stale = 0
+        self.served_age_total = 0.0
+        self.served_age_max = 0.0
+
+    def lookup(self, version=None):
+        """Cached response for the current request, or None. An entry built
+        at another version is a miss: tags are only invalidated in the
+        process that made the change, the version is read from the database
+        (so writes by the job worker or other app processes count too)."""
+        entry = self.backend.get(request.full_path)
+        if entry is not None and version is not None and entry[3] != version[0]:
+            self.stale += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        body, stored_at, _, _ = entry
+        age = time.time() - stored_at
+        self.hits += 1
+        self.served_age_total += age
+        self.served_age_max = max(self.served_age_max, age)
+        response = current_app.response_class(body, 200, mimetype='application/json')
+        response.headers['X-Cache'] = 'HIT'
+        response.headers['Age'] = str(int(age))
+        return response
+
+    def store(self, payload, tags, version=None):
+        body = current_app.json.dumpb(payload) + b'\n'
+        self.backend.set(request.full_path, body, frozenset(tags), version[0] if version else None)
+        response = current_app.response_class(body, 200, mimetype='application/json')
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def invalidate(self, tags):
+        if tags:
+            self.invalidated += self.backend.invalidate(tags)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidated': self.invalidated,
+            'stale': self.stale,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'avg_age_served': self.served_age_total / self.hits if self.hits else 0.0,
+            'max_age_served': self.served_age_max,
+        }
+
+
+def _backend_from_env():
+    ttl = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    if os.environ.get('RESPONSE_CACHE_URL'):
+        return RedisBackend(os.environ['RESPONSE_CACHE_URL'], ttl=ttl)
+    return LRUBackend(int(os.environ.get('RESPONSE_CACHE_SIZE', 2048)), ttl=ttl)
+
+
+response_cache = ResponseCache(_backend_from_env())
+
+
+###################### TAGS ######################
+
+# Tags of the rows a cached payload was built from. A payload is tagged with
+# every row it shows plus the parents whose deletion removes it. Children a
+# sparse view (?fields=) did not load are not in the payload, so they are
+# skipped rather than loaded.
+
+def _loaded(obj, key):
+    return key not in inspect(obj).unloaded
+
+
+def user_tags(user):
+    cities = user.cities if _loaded(user, 'cities') else ()
+    return {f'user:{user.id}'} | {f'city:{city.id}' for city in cities}
+
+
+def city_tags(city):
+    locations = city.locations if _loaded(city, 'locations') else ()
+    return ({f'city:{city.id}', f'user:{city.user_id}'}
+            | {f'location:{location.id}' for location in locations})
+
+
+def location_tags(location):
+    return {f'location:{location.id}', f'city:{location.city_id}', f'user:{location.user_id}'}
+
+
+# What a changed row invalidates: its own tag and the parents whose payloads
+# embed it.
+PARENT_KEYS = {
+    User: (),
+    City: (('user', 'user_id'),),
+    Location: (('city', 'city_id'), ('user', 'user_id')),
+    CityNote: (('city', 'city_id'),),
+    LocationNote: (('location', 'location_id'),),
+}
+OWN_TAG = {User: 'user', City: 'city', Location: 'location'}
+
+
+def changed_tags(obj):
+    model = type(obj)
+    if model not in PARENT_KEYS:
+        return set()
+    tags = set()
+    if model in OWN_TAG and obj.id is not None:
+        tags.add(f'{OWN_TAG[model]}:{obj.id}')
+    state = inspect(obj)
+    for prefix, column in PARENT_KEYS[model]:
+        history = state.attrs[column].history
+        for value in (*history.unchanged, *history.added, *history.deleted):
+            if value is not None:
+                tags.add(f'{prefix}:{value}')
+    return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changed_tags(session, flush_context):
+    pending = session.info.setdefault('cache_tags', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        pending |= changed_tags(obj)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def collect_bulk_insert_tags(orm_execute_state):
+    # Bulk insert(Model) statements never pass through session.new.
+    mapper = orm_execute_state.bind_mapper
+    if not orm_execute_state.is_insert or mapper is None:
+        return
+    params = orm_execute_state.parameters
+    rows = params if isinstance(params, list) else [params or {}]
+    pending = orm_execute_state.session.info.setdefault('cache_tags', set())
+    for prefix, column in PARENT_KEYS.get(mapper.class_, ()):
+        pending |= {f'{prefix}:{row[column]}' for row in rows if row.get(column) is not None}
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    response_cache.invalidate(session.info.pop('cache_tags', set()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_pending_tags(session, previous_transaction):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,89 @@
+# Standard library imports
+import hashlib
+from datetime import timezone
+
+# Remote library imports
+from flask import current_app, request
+from sqlalchemy import select, func, literal, union_all
+
+# Local imports
+from config import db
+from models import User, City, CityNote, Location, LocationNote
+
+
+def _aggregate(model, *where, join=None):
+    # count and max(id) change on deletes and inserts, the sum of row
+    # versions on every update; the timestamp only feeds Last-Modified
+    stmt = select(
+        func.count(model.id),
+        func.max(model.id),
+        func.max(func.coalesce(model.updated_at, model.created_at)),
+        func.sum(model.__table__.c.version),
+    )
+    if join is not None:
+        stmt = stmt.join(*join)
+    return stmt.where(*where)
+
+
+def _version(*parts):
+    """Runs the per-table aggregates as one UNION ALL round trip. Returns
+    (etag, last_modified), or None when the root row does not exist."""
+    # UNION ALL does not keep the parts in order (Postgres may run them as a
+    # parallel append), so each row says which part it came from
+    parts = [part.add_columns(literal(index).label('part')) for index, part in enumerate(parts)]
+    rows = sorted(db.session.execute(union_all(*parts)).all(), key=lambda row: row.part)
+    if not rows or rows[0].part != 0 or rows[0][0] == 0:
+        return None
+    etag = hashlib.md5(repr([tuple(row) for row in rows]).encode()).hexdigest()
+    stamps = [row[2] for row in rows if row[2] is not None]
+    last_modified = max(stamps).replace(tzinfo=timezone.utc) if stamps else None
+    return etag, last_modified
+
+
+def user_version(id):
+    return _version(
+        _aggregate(User, User.id == id),
+        _aggregate(City, City.user_id == id),
+        _aggregate(Location, City.user_id == id, join=(City, Location.city_id == City.id)),
+        _aggregate(CityNote, City.user_id == id, join=(City, CityNote.city_id == City.id)),
+    )
+
+
+def city_version(id):
+    return _version(
+        _aggregate(City, City.id == id),
+        _aggregate(Location, Location.city_id == id),
+        _aggregate(CityNote, CityNote.city_id == id),
+        _aggregate(LocationNote, Location.city_id == id,
+                   join=(Location, LocationNote.location_id == Location.id)),
+    )
+
+
+def location_version(id):
+    return _version(
+        _aggregate(Location, Location.id == id),
+        _aggregate(LocationNote, LocationNote.location_id == id),
+    )
+
+
+def not_modified(version):
+    """304 response when the request's validators still match, else None.
+    If-None-Match wins over If-Modified-Since when both are sent."""
+    etag, last_modified = version
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return with_version(current_app.response_class(status=304), version)
+
+
+def with_version(response, version):
+    etag, last_modified = version
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
@@ -9,12 +9,18 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
 
 # Local imports
+from json_provider import FastJSONProvider
+from pool import engine_options
 
 # Instantiate app, set attributes
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.json = FastJSONProvider(app)
+# Responses are compact; JSON_PRETTY=1 (or debug mode) indents them.
+if os.environ.get('JSON_PRETTY'):
+    app.json.compact = False
 
 # Define metadata, instantiate db
 metadata = MetaData(naming_convention={
@@ -0,0 +1,123 @@
+# Remote library imports
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+# Local imports
+from serializers import FieldPlan, MAX_DEPTH, compiled, serialize
+
+# distinct (fields, include) strings are client controlled, so the memo of
+# built views is bounded
+MAX_VIEWS = 512
+
+
+class Fieldset:
+    """The payload one request asked for: the plan to serialize with and
+    the loader options that read no more than the plan shows."""
+    __slots__ = ('plan', 'options')
+
+    def __init__(self, plan, options):
+        self.plan = plan
+        self.options = tuple(options)
+
+    def serialize(self, obj):
+        return serialize(obj, plan=self.plan)
+
+
+def _tree(value):
+    """'id,locations.rating' -> {'id': {}, 'locations': {'rating': {}}}"""
+    tree = {}
+    for path in (part.strip() for part in (value or '').split(',')):
+        if not path:
+            continue
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def _column_names(plan):
+    return [*plan.plain, *(key for key, _ in plan.formatted), *plan.other]
+
+
+def _columns_only(plan, names=None):
+    narrowed = FieldPlan()
+    narrowed.plain = [key for key in plan.plain if names is None or key in names]
+    narrowed.formatted = [(key, fmt) for key, fmt in plan.formatted if names is None or key in names]
+    narrowed.other = [key for key in plan.other if names is None or key in names]
+    return narrowed
+
+
+def _narrow(model, base, fields, include, parent=None, path='', depth=0):
+    # A level that names fields shows exactly those columns (plus id) and
+    # the relationships named in fields or include. Otherwise it keeps the
+    # default shape and include adds to it. Columns are limited to the ones
+    # the model's serialize_rules show; any relationship may be included
+    # except the one straight back to the parent.
+    if depth > MAX_DEPTH:
+        raise ValueError(f'fields and include nest past depth {MAX_DEPTH}.')
+    own = compiled(model)
+    columns = set(_column_names(own))
+    relationships = {key: rel for key, rel in inspect(model).relationships.items()
+                     if parent is None or rel.mapper.class_ is not parent}
+    for name in (*fields, *include):
+        if name not in columns and name not in relationships:
+            raise ValueError(f'unknown field {path}{name}.')
+        # a column has nothing under it: fields=id.foo names no field
+        if name in columns and (fields.get(name) or include.get(name)):
+            child = next(iter(fields.get(name) or include.get(name)))
+            raise ValueError(f'unknown field {path}{name}.{child}.')
+    if base is None:
+        base = _columns_only(own)
+    included = {name for name in include if name in columns}
+    if fields:
+        plan = _columns_only(own, {'id', *included, *(name for name in fields if name in columns)})
+    else:
+        plan = _columns_only(own, {*_column_names(base), *included})
+
+    children = dict((*base.to_one, *base.to_many))
+    names = [name for name in (*fields, *include) if name in relationships]
+    if not fields:
+        names = [*children, *names]
+    for key in dict.fromkeys(names):
+        rel = inspect(model).relationships[key]
+        child = _narrow(rel.mapper.class_, children.get(key), fields.get(key, {}), include.get(key, {}),
+                        model, f'{path}{key}.', depth + 1)
+        (plan.to_many if rel.uselist else plan.to_one).append((key, child))
+    return plan
+
+
+def _loaders(model, plan):
+    # The shown columns plus the primary and foreign keys, which relationship
+    # loading and the cache tags read.
+    mapper = inspect(model)
+    keys = {key for key in _column_names(plan) if key in mapper.column_attrs}
+    keys |= {attr.key for attr in mapper.column_attrs
+             if any(column.primary_key or column.foreign_keys for column in attr.columns)}
+    options = [load_only(*(getattr(model, key) for key in sorted(keys)))]
+    for key, child in (*plan.to_one, *plan.to_many):
+        rel = mapper.relationships[key]
+        loader = (selectinload if rel.uselist else joinedload)(getattr(model, key))
+        options.append(loader.options(*_loaders(rel.mapper.class_, child)))
+    return options
+
+
+_views = {}
+
+
+def fieldset(model, args, loaders=(), rules=()):
+    """The view of `model` asked for with `?fields=` and `?include=`, e.g.
+    `?fields=id,city_name&include=locations`. Dotted names reach into
+    relationships (`fields=id,locations.rating`). Without either parameter
+    it is the resource's usual shape: `rules` and its `loaders`. Raises
+    ValueError on a name the model does not have."""
+    fields, include = args.get('fields', ''), args.get('include', '')
+    if not fields.strip(' ,') and not include.strip(' ,'):
+        return Fieldset(compiled(model, rules), loaders)
+    key = (model, tuple(rules), fields, include)
+    view = _views.get(key)
+    if view is None:
+        plan = _narrow(model, compiled(model, rules), _tree(fields), _tree(include))
+        if len(_views) >= MAX_VIEWS:
+            _views.clear()
+        view = _views[key] = Fieldset(plan, _loaders(model, plan))
+    return view
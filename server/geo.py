@@ -0,0 +1,167 @@
+# Standard library imports
+import math
+import re
+
+# Remote library imports
+from sqlalchemy import and_, or_, select
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9  # ~5m cells
+MAX_COVER_CELLS = 32
+EARTH_RADIUS_M = 6_371_000
+
+# google maps urls carry coordinates as /@lat,lng,zoom or !3dlat!4dlng or ?q=lat,lng
+MAP_URL_PATTERNS = (
+    re.compile(r'!3d(-?\d+(?:\.\d+)?)!4d(-?\d+(?:\.\d+)?)'),
+    re.compile(r'@(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)'),
+    re.compile(r'[?&](?:q|ll|query)=(-?\d+(?:\.\d+)?),\s*(-?\d+(?:\.\d+)?)'),
+)
+
+
+def encode(lat, lng, precision=PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell."""
+    total = 5 * precision
+    lng_bits = (total + 1) // 2
+    lat_bits = total // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def cover(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """Geohash prefixes covering a bounding box: the longest prefixes for
+    which at most `max_cells` are needed, so the index scan only reads rows
+    near the box. Boxes crossing the antimeridian are split."""
+    if min_lng > max_lng:
+        return (cover(min_lat, min_lng, max_lat, 180.0, max_cells // 2)
+                + cover(min_lat, -180.0, max_lat, max_lng, max_cells // 2))
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1
+        cols = math.floor((max_lng + 180) / width) - math.floor((min_lng + 180) / width) + 1
+        if rows * cols <= max_cells or precision == 1:
+            break
+    cells = set()
+    lat0 = math.floor((min_lat + 90) / height) * height - 90
+    lng0 = math.floor((min_lng + 180) / width) * width - 180
+    for r in range(rows):
+        for c in range(cols):
+            lat = min(lat0 + (r + 0.5) * height, 90.0)
+            lng = min(lng0 + (c + 0.5) * width, 180.0)
+            cells.add(encode(lat, lng, precision))
+    return sorted(cells)
+
+
+def prefix_end(prefix):
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def prefix_ranges(prefixes):
+    """[start, end) string ranges for sorted prefixes, merging neighbours so
+    adjacent cells cost one index seek."""
+    ranges = []
+    for prefix in prefixes:
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = prefix_end(prefix)
+        else:
+            ranges.append([prefix, prefix_end(prefix)])
+    return ranges
+
+
+def parse_map_url(url):
+    if not url:
+        return None
+    for pattern in MAP_URL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            lat, lng = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lng <= 180:
+                return lat, lng
+    return None
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def radius_bbox(lat, lng, radius_m):
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    coslat = math.cos(math.radians(lat))
+    dlng = 180.0 if coslat < 1e-9 else min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * coslat)))
+    min_lng, max_lng = lng - dlng, lng + dlng
+    if dlng >= 180.0:
+        min_lng, max_lng = -180.0, 180.0
+    else:
+        min_lng = min_lng + 360 if min_lng < -180 else min_lng
+        max_lng = max_lng - 360 if max_lng > 180 else max_lng
+    return max(lat - dlat, -90.0), min_lng, min(lat + dlat, 90.0), max_lng
+
+
+def coordinate(key, value):
+    """Validated float for 'lat' or 'lng'; None passes through."""
+    if value is None:
+        return None
+    limit = 90 if key == 'lat' else 180
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not -limit <= value <= limit:
+        raise ValueError(f'{value} not an allowed value for {key}.')
+    return float(value)
+
+
+def point_fields(lat, lng, google_map_url=None):
+    """lat/lng/geohash for a location, falling back to the map url."""
+    lat, lng = coordinate('lat', lat), coordinate('lng', lng)
+    if lat is None or lng is None:
+        lat, lng = parse_map_url(google_map_url) or (None, None)
+    if lat is None:
+        return {'lat': None, 'lng': None, 'geohash': None}
+    return {'lat': lat, 'lng': lng, 'geohash': encode(lat, lng)}
+
+
+def parse_bbox(value):
+    """'min_lng,min_lat,max_lng,max_lat' -> (min_lat, min_lng, max_lat, max_lng)."""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('bbox must be min_lng,min_lat,max_lng,max_lat.')
+    for key, part in (('lat', min_lat), ('lat', max_lat), ('lng', min_lng), ('lng', max_lng)):
+        coordinate(key, part)
+    if min_lat > max_lat:
+        raise ValueError('bbox min_lat is greater than max_lat.')
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def bbox_clause(model, min_lat, min_lng, max_lat, max_lng):
+    """WHERE clause for rows of `model` inside the box. The geohash ranges
+    pick the candidates off the index and the lat/lng tests trim the cell
+    edges, so only rows near the box are read. It is an id subquery so a
+    keyset ORDER BY id cannot talk the planner into a primary key scan."""
+    cells = or_(*(and_(model.geohash >= start, model.geohash < end)
+                  for start, end in prefix_ranges(cover(min_lat, min_lng, max_lat, max_lng))))
+    if min_lng <= max_lng:
+        lng = model.lng.between(min_lng, max_lng)
+    else:
+        lng = or_(model.lng >= min_lng, model.lng <= max_lng)
+    return model.id.in_(select(model.id).where(cells, model.lat.between(min_lat, max_lat), lng))
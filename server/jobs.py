@@ -0,0 +1,247 @@
+# Standard library imports
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+# Remote library imports
+from flask import make_response, url_for
+from sqlalchemy import case, delete, func, select, text, update
+
+# Local imports
+from config import app, db
+from models import Job, utcnow
+
+POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+# a running job whose worker has not finished it within the lease is
+# presumed dead and handed out again
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 900))
+# retry n waits BACKOFF_SECONDS * 2 ** (n - 1)
+BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', 5))
+MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+HOUSEKEEPING_SECONDS = 60
+# postgres advisory lock held while claiming, so two workers cannot both
+# see room under a kind's concurrency limit
+CLAIM_LOCK = 0x6a6f6273
+
+log = logging.getLogger('vicariously.jobs')
+
+
+###################### REGISTRY ######################
+
+class Handler:
+    __slots__ = ('func', 'concurrency', 'max_attempts')
+
+    def __init__(self, func, concurrency, max_attempts):
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+
+HANDLERS = {}
+
+
+def job(kind, concurrency=None, max_attempts=MAX_ATTEMPTS):
+    """Registers `func(payload)` as the handler for `kind`. It runs inside an
+    app context with its own session and returns a JSON-able result.
+    `concurrency` caps how many jobs of the kind run at once across all
+    workers. Delivery is at least once: a job is retried after an error or
+    when its worker dies, so handlers must tolerate running twice."""
+    def register(func):
+        HANDLERS[kind] = Handler(func, concurrency, max_attempts)
+        return func
+    return register
+
+
+class JobError(Exception):
+    """Raised by a handler for a failure retrying cannot fix; the job fails
+    at once and `detail` becomes its result."""
+
+    def __init__(self, message, detail=None):
+        super().__init__(message)
+        self.detail = detail
+
+
+###################### ENQUEUE ######################
+
+def wants_async(request):
+    return request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', '')
+
+
+def enqueue(kind, payload=None):
+    if kind not in HANDLERS:
+        raise ValueError(f'{kind} is not a job kind.')
+    new_job = Job(kind=kind, payload=payload, max_attempts=HANDLERS[kind].max_attempts)
+    db.session.add(new_job)
+    db.session.commit()
+    return new_job
+
+
+def accepted(new_job):
+    """202 pointing the client at the job to poll."""
+    status_url = url_for('jobbyid', id=new_job.id)
+    return make_response({'job_id': new_job.id, 'status': new_job.status, 'status_url': status_url},
+                         202, {'Location': status_url})
+
+
+def job_stats():
+    """{(kind, status): count} of the jobs still queued or running."""
+    rows = db.session.execute(
+        select(Job.kind, Job.status, func.count())
+        .where(Job.status.in_(('queued', 'running')))
+        .group_by(Job.kind, Job.status)).all()
+    return {(kind, status): count for kind, status, count in rows}
+
+
+###################### WORKER ######################
+
+def claim(worker_id):
+    """Marks the oldest due job this process can run as running and returns
+    its id, or None. The UPDATE only succeeds while the job is still queued
+    and its kind is under its concurrency limit, so workers racing for the
+    same row cannot both win."""
+    session = db.session
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': CLAIM_LOCK})
+    now = utcnow()
+    running = dict(session.execute(
+        select(Job.kind, func.count()).where(Job.status == 'running').group_by(Job.kind)).all())
+    kinds = [kind for kind, handler in HANDLERS.items()
+             if not handler.concurrency or running.get(kind, 0) < handler.concurrency]
+    candidate = session.execute(
+        select(Job.id, Job.kind)
+        .where(Job.status == 'queued', Job.run_after <= now, Job.kind.in_(kinds))
+        .order_by(Job.run_after, Job.id).limit(1)).first()
+    if candidate is None:
+        session.rollback()
+        return None
+    where = [Job.id == candidate.id, Job.status == 'queued']
+    limit = HANDLERS[candidate.kind].concurrency
+    if limit:
+        where.append(select(func.count()).where(
+            Job.kind == candidate.kind, Job.status == 'running').scalar_subquery() < limit)
+    claimed = session.execute(
+        update(Job).where(*where)
+        .values(status='running', attempts=Job.attempts + 1, locked_by=worker_id, locked_at=now)
+    ).rowcount
+    session.commit()
+    return candidate.id if claimed else None
+
+
+def run(job_id):
+    current = db.session.get(Job, job_id)
+    handler = HANDLERS[current.kind]
+    started = time.perf_counter()
+    try:
+        result = handler.func(current.payload or {})
+    except Exception as ex:
+        db.session.rollback()
+        current = db.session.get(Job, job_id)
+        current.error = f'{type(ex).__name__}: {ex}'
+        current.locked_by = current.locked_at = None
+        if isinstance(ex, JobError) or current.attempts >= current.max_attempts:
+            current.status = 'failed'
+            current.result = getattr(ex, 'detail', None)
+            current.finished_at = utcnow()
+            log.warning('job %s %s failed after %s attempt(s): %s',
+                        job_id, current.kind, current.attempts, current.error)
+        else:
+            current.status = 'queued'
+            current.run_after = utcnow() + timedelta(seconds=BACKOFF_SECONDS * 2 ** (current.attempts - 1))
+            log.info('job %s %s will be retried: %s', job_id, current.kind, current.error)
+        db.session.commit()
+        return
+    current = db.session.get(Job, job_id)
+    current.status = 'succeeded'
+    current.result = result
+    current.error = None
+    current.locked_by = current.locked_at = None
+    current.finished_at = utcnow()
+    db.session.commit()
+    log.info('job %s %s succeeded in %.2fs', job_id, current.kind, time.perf_counter() - started)
+
+
+def housekeeping():
+    """Requeues (or fails) jobs whose lease expired and drops finished jobs
+    past the retention period."""
+    now = utcnow()
+    expired = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < now - timedelta(seconds=LEASE_SECONDS))
+        .values(status=case((Job.attempts >= Job.max_attempts, 'failed'), else_='queued'),
+                error='lease expired', locked_by=None, locked_at=None)
+    ).rowcount
+    pruned = db.session.execute(
+        delete(Job).where(Job.status.in_(('succeeded', 'failed')),
+                          Job.finished_at < now - timedelta(days=RETENTION_DAYS))
+    ).rowcount
+    db.session.commit()
+    if expired or pruned:
+        log.info('requeued %s expired job(s), pruned %s finished job(s)', expired, pruned)
+
+
+def pending():
+    return db.session.execute(
+        select(func.count()).select_from(Job)
+        .where(Job.status.in_(('queued', 'running')), Job.kind.in_(list(HANDLERS)))).scalar()
+
+
+class Worker:
+    """Runs `concurrency` threads, each claiming and running one job at a
+    time with its own app context and session. With `burst` the threads
+    exit once nothing they could run is queued or running, which is how
+    tests and one-off maintenance drain the queue."""
+
+    def __init__(self, concurrency=1, poll=POLL_SECONDS, burst=False):
+        self.concurrency = concurrency
+        self.poll = poll
+        self.burst = burst
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._next_housekeeping = 0.0
+        self._housekeeping_lock = threading.Lock()
+
+    def stop(self):
+        """Lets each thread finish its current job, then exit."""
+        self._stop.set()
+
+    def run(self):
+        threads = [threading.Thread(target=self._loop, args=(n,), name=f'job-worker-{n}')
+                   for n in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _loop(self, n):
+        worker_id = f'{self.name}:{n}'
+        with app.app_context():
+            while not self._stop.is_set():
+                try:
+                    self._maybe_housekeep()
+                    job_id = claim(worker_id)
+                    if job_id is not None:
+                        run(job_id)
+                    elif self.burst and not pending():
+                        return
+                except Exception:
+                    log.exception('job worker %s', worker_id)
+                    job_id = None
+                finally:
+                    # a fresh session per job: nothing memoized carries over
+                    db.session.remove()
+                if job_id is None:
+                    self._stop.wait(self.poll)
+
+    def _maybe_housekeep(self):
+        if not self._housekeeping_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() >= self._next_housekeeping:
+                self._next_housekeeping = time.monotonic() + HOUSEKEEPING_SECONDS
+                housekeeping()
+        finally:
+            self._housekeeping_lock.release()
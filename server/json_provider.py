@@ -0,0 +1,49 @@
+# Remote library imports
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Encodes with orjson when it is installed, otherwise behaves exactly
+    like Flask's default provider. orjson writes datetimes natively as ISO
+    8601 and emits UTF-8 rather than \\u escapes. Output is compact unless
+    `compact` is False or the app runs in debug mode."""
+
+    def _options(self, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _pretty(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumpb(self, obj):
+        if orjson is None:
+            return self.dumps(obj).encode()
+        return orjson.dumps(obj, default=self.default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        # Extra json.dumps kwargs (indent, cls, ...) only make sense to the stdlib.
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._options(pretty=self._pretty()) | orjson.OPT_APPEND_NEWLINE
+        body = orjson.dumps(obj, default=self.default, option=option)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,39 @@
+# Remote library imports
+from sqlalchemy.orm import configure_mappers, joinedload, selectinload, undefer
+
+# Local imports
+from models import User, City, CityNote, Location, LocationNote
+
+# The backref attributes (City.user, CityNote.city, ...) only exist once the
+# mappers are configured.
+configure_mappers()
+
+# Loader options mirroring what each model's serialize_rules walk in
+# to_dict(), so a nested payload costs one SELECT per relationship level
+# instead of one per parent row.
+
+# user -> cities (with city_imgs) -> (locations, city_notes) [ids only]
+USER_LOADERS = (
+    selectinload(User.cities).undefer(City.city_imgs),
+    selectinload(User.cities).selectinload(City.locations),
+    selectinload(User.cities).selectinload(City.city_notes),
+)
+
+# city -> locations -> location_notes, city -> city_notes; city_imgs stays
+# deferred since CityById leaves it out
+CITY_LOADERS = (
+    selectinload(City.locations).selectinload(Location.location_notes),
+    selectinload(City.city_notes),
+)
+
+# note -> city (with city_imgs) -> locations -> location_notes
+CITY_NOTE_LOADERS = (
+    joinedload(CityNote.city).undefer(City.city_imgs),
+    joinedload(CityNote.city).selectinload(City.locations).selectinload(Location.location_notes),
+)
+
+LOCATION_LOADERS = (
+    selectinload(Location.location_notes),
+)
+
+LOCATION_NOTE_LOADERS = ()
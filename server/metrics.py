@@ -0,0 +1,206 @@
+# Standard library imports
+import threading
+import time
+from bisect import bisect_left
+
+# Remote library imports
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Local imports
+from config import app
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SKIPPED_ENDPOINTS = ('metrics', 'static')
+
+
+###################### PRIMITIVES ######################
+
+class Histogram:
+    """Cumulative-bucket histogram per label set. Observing is a bisect and
+    three additions under a lock; the text is only built on scrape."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, n in zip((*self.buckets, '+Inf'), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for label_values, value in sorted(series.items()):
+            lines.append(f'{self.name}{{{_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def gauges(name, help, kind, values):
+    """Exposition lines for one metric read from a stats() dict at scrape time."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    lines.extend(f'{name}{{{_labels(labels, label_values)}}} {value}'
+                 if labels else f'{name} {value}'
+                 for labels, label_values, value in values)
+    return lines
+
+
+###################### REQUEST METRICS ######################
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Time spent handling the request.',
+    ('route', 'method'), LATENCY_BUCKETS)
+response_size = Histogram(
+    'http_response_size_bytes', 'Size of the response body (streamed bodies excluded).',
+    ('route', 'method'), SIZE_BUCKETS)
+responses = Counter(
+    'http_responses_total', 'Responses by status code.',
+    ('route', 'method', 'status'))
+request_queries = Histogram(
+    'db_statements_per_request', 'SQL statements executed while handling the request.',
+    ('route', 'method'), QUERY_BUCKETS)
+request_db_time = Histogram(
+    'db_time_per_request_seconds', 'Time spent in SQL statements while handling the request.',
+    ('route', 'method'), LATENCY_BUCKETS)
+statements = Counter(
+    'db_statements_total', 'SQL statements executed, in or out of a request.',
+    ('in_request',))
+
+REQUEST_METRICS = (request_latency, response_size, responses, request_queries, request_db_time, statements)
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+
+
+@app.after_request
+def record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None or request.endpoint in SKIPPED_ENDPOINTS:
+        return response
+    # the url rule keeps the label set bounded: /users/<int:id>, not /users/7
+    key = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+    request_latency.observe(key, time.perf_counter() - start)
+    if not response.is_streamed and response.content_length is not None:
+        response_size.observe(key, response.content_length)
+    responses.inc((*key, response.status_code))
+    request_queries.observe(key, g.sql_count)
+    request_db_time.observe(key, g.sql_seconds)
+    return response
+
+
+# The start time lives on the statement's execution context, which is
+# dropped with it when the statement fails, so nothing is left behind for
+# after_cursor_execute to pop. The few cursor calls SQLAlchemy makes without
+# a context (sequence pre-execution) use one slot on the connection instead.
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        conn.info['statement_start'] = time.perf_counter()
+    else:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        start = conn.info.pop('statement_start')
+    else:
+        start = context.metrics_start
+    elapsed = time.perf_counter() - start
+    in_request = has_request_context() and 'sql_count' in g
+    if in_request:
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+    statements.inc(('true' if in_request else 'false',))
+
+
+###################### EXPOSITION ######################
+
+def render(pool_stats, response_cache_stats, email_cache_stats, job_stats):
+    """Prometheus text exposition (format 0.0.4) of everything above plus the
+    pool, cache and job queue stats. Each Gunicorn worker answers for
+    itself, except for the job counts, which are read from the database."""
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+    for name, kind, key, help in (
+        ('db_pool_connects_total', 'counter', 'connects', 'New DBAPI connections opened.'),
+        ('db_pool_checkouts_total', 'counter', 'checkouts', 'Connections checked out of the pool.'),
+        ('db_pool_overflow_checkouts_total', 'counter', 'overflow_checkouts', 'Checkouts served beyond pool_size.'),
+        ('db_pool_invalidations_total', 'counter', 'invalidations', 'Connections invalidated.'),
+        ('db_pool_timeouts_total', 'counter', 'timeouts', 'Checkouts that gave up waiting.'),
+        ('db_pool_wait_seconds_total', 'counter', 'wait_seconds_total', 'Time spent waiting for a connection.'),
+        ('db_pool_wait_seconds_max', 'gauge', 'wait_seconds_max', 'Longest wait for a connection.'),
+        ('db_pool_checked_out', 'gauge', 'checked_out', 'Connections currently checked out.'),
+        ('db_pool_overflow', 'gauge', 'overflow', 'Overflow connections currently open.'),
+    ):
+        if key in pool_stats:
+            lines.extend(gauges(name, help, kind, [((), (), pool_stats[key])]))
+    for cache, stats in (('response', response_cache_stats), ('email', email_cache_stats)):
+        for key in ('hits', 'misses'):
+            lines.extend(gauges(f'{cache}_cache_{key}_total', f'{cache} cache {key}.', 'counter',
+                                [((), (), stats[key])]))
+        if stats['size'] is not None:
+            lines.extend(gauges(f'{cache}_cache_entries', f'Entries in the {cache} cache.', 'gauge',
+                                [((), (), stats['size'])]))
+    lines.extend(gauges('response_cache_invalidated_total', 'Response cache entries dropped by writes.',
+                        'counter', [((), (), response_cache_stats['invalidated'])]))
+    lines.extend(gauges('response_cache_stale_total', 'Response cache entries built at an older version.',
+                        'counter', [((), (), response_cache_stats['stale'])]))
+    lines.extend(gauges('email_cache_evictions_total', 'Email cache LRU evictions.',
+                        'counter', [((), (), email_cache_stats['evictions'])]))
+    lines.extend(gauges('jobs', 'Background jobs queued or running.', 'gauge',
+                        [(('kind', 'status'), key, count) for key, count in sorted(job_stats.items())]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,50 @@
+"""search documents
+
+Revision ID: 0149b858188c
+Revises: cefb99f84cf8
+Create Date: 2026-10-18 17:31:07.442975
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0149b858188c'
+down_revision = 'cefb99f84cf8'
+branch_labels = None
+depends_on = None
+
+SOURCES = (
+    ('city', 0, 'cities', 'city_name'),
+    ('location', 1, 'locations', 'location_name'),
+    ('city_note', 2, '"cityNotes"', 'note_body'),
+    ('location_note', 3, '"locationNotes"', 'note_body'),
+)
+
+
+def upgrade():
+    # Postgres: tsvector + GIN. SQLite (local/tests): FTS5 virtual table.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            'CREATE TABLE search_documents ('
+            'doc_type VARCHAR NOT NULL, doc_id INTEGER NOT NULL, body TEXT NOT NULL, '
+            "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED, "
+            'PRIMARY KEY (doc_type, doc_id))')
+        op.execute('CREATE INDEX search_documents_tsv_index ON search_documents USING GIN (tsv)')
+        for doc_type, _, table, column in SOURCES:
+            op.execute(
+                f'INSERT INTO search_documents (doc_type, doc_id, body) '
+                f"SELECT '{doc_type}', id, {column} FROM {table}")
+    else:
+        op.execute(
+            'CREATE VIRTUAL TABLE search_documents '
+            'USING fts5(doc_type UNINDEXED, doc_id UNINDEXED, body)')
+        for doc_type, code, table, column in SOURCES:
+            op.execute(
+                f'INSERT INTO search_documents (rowid, doc_type, doc_id, body) '
+                f"SELECT id * 4 + {code}, '{doc_type}', id, {column} FROM {table}")
+
+
+def downgrade():
+    op.execute('DROP TABLE search_documents')
@@ -0,0 +1,58 @@
+"""location points
+
+Revision ID: 5c1e8a3f02d7
+Revises: 0149b858188c
+Create Date: 2026-10-18 18:05:23.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import geo
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a3f02d7'
+down_revision = '0149b858188c'
+branch_labels = None
+depends_on = None
+
+
+def _backfill():
+    # coordinates for existing rows come from their google maps urls
+    locations = sa.table(
+        'locations',
+        sa.column('id', sa.Integer),
+        sa.column('google_map_url', sa.String),
+        sa.column('lat', sa.Float),
+        sa.column('lng', sa.Float),
+        sa.column('geohash', sa.String),
+    )
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(locations.c.id, locations.c.google_map_url).where(locations.c.google_map_url.isnot(None))
+    ).fetchall()
+    for location_id, url in rows:
+        point = geo.point_fields(None, None, url)
+        if point['geohash']:
+            conn.execute(locations.update().where(locations.c.id == location_id).values(point))
+
+
+def upgrade():
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lat', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('lng', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column(
+            'geohash', sa.String().with_variant(postgresql.VARCHAR(collation='C'), 'postgresql'), nullable=True))
+        batch_op.create_index('locations_geohash_index', ['geohash'], unique=False)
+
+    _backfill()
+
+
+def downgrade():
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.drop_index('locations_geohash_index')
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('lng')
+        batch_op.drop_column('lat')
@@ -0,0 +1,65 @@
+"""city imgs json
+
+Revision ID: 6178701b234a
+Revises: acd971d8775e
+Create Date: 2026-10-18 16:40:12.114302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '6178701b234a'
+down_revision = 'acd971d8775e'
+branch_labels = None
+depends_on = None
+
+
+JSON = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def _copy(src_type, dst_type, src='city_imgs', dst='city_imgs_tmp'):
+    cities = sa.table(
+        'cities',
+        sa.column('id', sa.Integer),
+        sa.column(src, src_type),
+        sa.column(dst, dst_type),
+    )
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(cities.c.id, cities.c[src]).where(cities.c[src].isnot(None))
+    ).fetchall()
+    for city_id, imgs in rows:
+        conn.execute(cities.update().where(cities.c.id == city_id).values({dst: imgs}))
+
+
+def _restore_sqlite_index():
+    # SQLite batch mode rebuilds the table and cannot reflect the
+    # expression index, so it has to be recreated by hand.
+    if op.get_bind().dialect.name == 'sqlite':
+        op.create_index('user_city_country_index', 'cities',
+                        [sa.text('lower(country)'), sa.text('lower(city_name)'), 'user_id'], unique=True)
+
+
+def upgrade():
+    # pickled lists of image urls -> JSON, converted in Python since the
+    # database cannot read pickles
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('city_imgs_tmp', JSON, nullable=True))
+    _copy(sa.PickleType(), JSON)
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.drop_column('city_imgs')
+        batch_op.alter_column('city_imgs_tmp', new_column_name='city_imgs')
+    _restore_sqlite_index()
+
+
+def downgrade():
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('city_imgs_tmp', sa.PickleType(), nullable=True))
+    _copy(JSON, sa.PickleType())
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.drop_column('city_imgs')
+        batch_op.alter_column('city_imgs_tmp', new_column_name='city_imgs')
+    _restore_sqlite_index()
@@ -0,0 +1,54 @@
+"""on delete cascade
+
+Revision ID: 9a4d27c51e36
+Revises: 5c1e8a3f02d7
+Create Date: 2026-10-18 18:40:55.217630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4d27c51e36'
+down_revision = '5c1e8a3f02d7'
+branch_labels = None
+depends_on = None
+
+# (table, constraint, column, referred table), parents first
+FOREIGN_KEYS = (
+    ('cities', 'fk_cities_user_id_users', 'user_id', 'users'),
+    ('cityNotes', 'fk_cityNotes_city_id_cities', 'city_id', 'cities'),
+    ('locations', 'fk_locations_city_id_cities', 'city_id', 'cities'),
+    ('locations', 'fk_locations_user_id_users', 'user_id', 'users'),
+    ('locationNotes', 'fk_locationNotes_location_id_locations', 'location_id', 'locations'),
+)
+# Earlier SQLite batch rebuilds lost some of the names; the app's convention
+# lets batch mode name the reflected keys again so they can be dropped.
+NAMING_CONVENTION = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+}
+
+
+def _restore_sqlite_index():
+    # SQLite batch mode rebuilds the table and cannot reflect the
+    # expression index, so it has to be recreated by hand.
+    if op.get_bind().dialect.name == 'sqlite':
+        op.create_index('user_city_country_index', 'cities',
+                        [sa.text('lower(country)'), sa.text('lower(city_name)'), 'user_id'], unique=True)
+
+
+def _replace_foreign_keys(ondelete):
+    for table, name, column, referred in FOREIGN_KEYS:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+    _restore_sqlite_index()
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
@@ -0,0 +1,46 @@
+"""fk filter indexes
+
+Revision ID: cefb99f84cf8
+Revises: 6178701b234a
+Create Date: 2026-10-18 17:02:41.530118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cefb99f84cf8'
+down_revision = '6178701b234a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.create_index('cities_user_index', ['user_id'], unique=False)
+
+    with op.batch_alter_table('cityNotes', schema=None) as batch_op:
+        batch_op.create_index('city_notes_city_type_index', ['city_id', 'note_type'], unique=False)
+
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.create_index('locations_city_category_index', ['city_id', 'category'], unique=False)
+        batch_op.create_index('locations_user_city_index', ['user_id', 'city_id'], unique=False)
+
+    with op.batch_alter_table('locationNotes', schema=None) as batch_op:
+        batch_op.create_index('location_notes_location_index', ['location_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('locationNotes', schema=None) as batch_op:
+        batch_op.drop_index('location_notes_location_index')
+
+    with op.batch_alter_table('locations', schema=None) as batch_op:
+        batch_op.drop_index('locations_user_city_index')
+        batch_op.drop_index('locations_city_category_index')
+
+    with op.batch_alter_table('cityNotes', schema=None) as batch_op:
+        batch_op.drop_index('city_notes_city_type_index')
+
+    with op.batch_alter_table('cities', schema=None) as batch_op:
+        batch_op.drop_index('cities_user_index')
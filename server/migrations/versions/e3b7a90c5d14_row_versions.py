@@ -0,0 +1,31 @@
+"""row versions
+
+Revision ID: e3b7a90c5d14
+Revises: 9244c46bdefe
+Create Date: 2026-10-18 17:25:41.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7a90c5d14'
+down_revision = '9244c46bdefe'
+branch_labels = None
+depends_on = None
+
+TABLES = ('users', 'cities', 'cityNotes', 'locations', 'locationNotes')
+
+
+def upgrade():
+    # existing rows start at version 1, as new ones do
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('version')
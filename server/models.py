@@ -1,13 +1,92 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import validates, Session, deferred
+from sqlalchemy.dialects import postgresql
 from config import db
-from sqlalchemy import UniqueConstraint, Index, func
+from sqlalchemy import UniqueConstraint, Index, func, event, inspect
+from sqlalchemy.engine import Engine
+import geo
+
+
+###################### SQLITE ######################
+
+# SQLite ignores foreign keys, ON DELETE CASCADE included, unless every
+# connection turns them on; aiosqlite (asgi.py) connections too. Those are
+# recognised by module, so the sync app never imports the async adapter.
+SQLITE_MODULES = ('sqlite3', 'sqlalchemy.dialects.sqlite.aiosqlite')
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if dbapi_connection.__class__.__module__ in SQLITE_MODULES:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+###################### FK VALIDATION ######################
+
+# Referenced ids already confirmed in the current session, keyed by
+# (tablename, id). Lives in session.info so it is dropped along with the
+# request-scoped session; the FK constraints remain the final word.
+VERIFIED_IDS_KEY = 'verified_ids'
+# tables emptied along with a deleted row by ON DELETE CASCADE
+CASCADED_TABLES = {
+    'users': {'cities', 'cityNotes', 'locations', 'locationNotes'},
+    'cities': {'cityNotes', 'locations', 'locationNotes'},
+    'locations': {'locationNotes'},
+}
+
+
+def id_exists(model, value):
+    verified = db.session.info.setdefault(VERIFIED_IDS_KEY, set())
+    key = (model.__tablename__, value)
+    if key in verified:
+        return True
+    with db.session.no_autoflush:
+        found = db.session.query(model.id).filter(model.id == value).first() is not None
+    if found:
+        verified.add(key)
+    return found
+
+
+@event.listens_for(Session, 'after_flush')
+def forget_deleted_ids(session, flush_context):
+    verified = session.info.get(VERIFIED_IDS_KEY)
+    if verified:
+        cascaded = set()
+        for obj in session.deleted:
+            verified.discard((obj.__tablename__, obj.id))
+            cascaded |= CASCADED_TABLES.get(obj.__tablename__, set())
+        # the database removed their descendants without telling the session
+        if cascaded:
+            verified -= {key for key in verified if key[0] in cascaded}
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_verified_ids(session, previous_transaction):
+    session.info.pop(VERIFIED_IDS_KEY, None)
+
+###################### ROW VERSIONS ######################
+
+
+class RowVersion:
+    """A `version` column that every UPDATE of the row increments, ORM flush
+    and Core update() alike. The ETags in conditional.py sum it: timestamps
+    miss a second write within the same second on SQLite, and within one
+    transaction on Postgres, where now() is the transaction start. The
+    column is left out of the mapper, so payloads and ?fields= never see it."""
+    __mapper_args__ = {'exclude_properties': ['version']}
+
+    version = db.Column('version', db.Integer, nullable=False, default=1, server_default='1',
+                        onupdate=db.literal_column('version') + 1)
+
 ###################### USER ######################
 
 
-class User(db.Model, SerializerMixin):
+class User(db.Model, SerializerMixin, RowVersion):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -17,14 +96,16 @@ class User(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
 
+    # children go with ON DELETE CASCADE; passive_deletes keeps the ORM
+    # from loading them just to delete them row by row
     cities = db.relationship("City", backref='user',
-                             cascade='all, delete, delete-orphan')
+                             cascade='all, delete-orphan', passive_deletes=True)
     locations = db.relationship(
-        "Location", backref='user', cascade='all, delete, delete-orphan')
+        "Location", backref='user', cascade='all, delete-orphan', passive_deletes=True)
 
     # users=association_proxy('checkout_logs','user')
 
-    serialize_rules = ( "-cities.locations.user","-cities.locations.avg_cost","-cities.locations.category","-cities.locations.date_visited","-cities.locations.google_map_url","-cities.locations.location_name","-cities.locations.location_notes","-cities.locations.rating","-cities.locations.website","-cities.locations.user_id","-cities.locations.city_id","-cities.city_notes.note_body","-cities.city_notes.note_type", "-locations", "-created_at", )
+    serialize_rules = ( "-cities.locations.user","-cities.locations.avg_cost","-cities.locations.category","-cities.locations.date_visited","-cities.locations.google_map_url","-cities.locations.location_name","-cities.locations.location_notes","-cities.locations.rating","-cities.locations.website","-cities.locations.user_id","-cities.locations.city_id","-cities.locations.lat","-cities.locations.lng","-cities.locations.geohash","-cities.city_notes.note_body","-cities.city_notes.note_type", "-locations", "-created_at", )
 
 
     @validates('email')
@@ -55,32 +136,32 @@ class User(db.Model, SerializerMixin):
 ###################### CITIES ######################
 
 
-class City(db.Model, SerializerMixin):
+class City(db.Model, SerializerMixin, RowVersion):
     __tablename__ = 'cities'
 
     id = db.Column(db.Integer, primary_key=True)
     city_name = db.Column(db.String, nullable=False)
     country = db.Column(db.String, nullable=False)
-    city_imgs = db.Column(db.PickleType)
+    # image urls; deferred so queries that don't serialize them skip the column
+    city_imgs = deferred(db.Column(db.JSON().with_variant(postgresql.JSONB(), 'postgresql')))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
 
     locations = db.relationship(
-        "Location", backref='city', cascade='all, delete, delete-orphan')
+        "Location", backref='city', cascade='all, delete-orphan', passive_deletes=True)
     city_notes = db.relationship(
-        "CityNote", backref='city', cascade='all, delete, delete-orphan')
+        "CityNote", backref='city', cascade='all, delete-orphan', passive_deletes=True)
 
     serialize_rules = ("-user", "-locations.city",
                        "-city_notes.city", "-locations.user", "-created_at", "-updated_at",)
     
     @validates('country','user_id','city_name')
     def validates_country(self, key, value):
-        users = [user.id for user in User.query.all()]
         if not value:
             raise ValueError(f'{key} must be provided.')
         if key =='user_id':
-            if value not in users:
+            if not id_exists(User, value):
                 raise ValueError('user_id does not exist.')
         return value
 
@@ -89,12 +170,13 @@ class City(db.Model, SerializerMixin):
         return f'<City {self.id} :: {self.city_name} | {self.country} | user: {self.user_id}>'
     
 Index('user_city_country_index', func.lower(City.country),func.lower(City.city_name),City.user_id, unique=True)
+Index('cities_user_index', City.user_id)
 
 
 ###################### CITY NOTES ######################
 
 
-class CityNote(db.Model, SerializerMixin):
+class CityNote(db.Model, SerializerMixin, RowVersion):
     __tablename__ = 'cityNotes'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -102,7 +184,7 @@ class CityNote(db.Model, SerializerMixin):
     note_type = db.Column(db.String, nullable=False, default='Other')
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
-    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id', ondelete='CASCADE'), nullable=False)
 
     serialize_rules = ("-city.city_notes", "-created_at", "-updated_at","-city_id",)
 
@@ -114,10 +196,9 @@ class CityNote(db.Model, SerializerMixin):
 
     @validates('city_id')
     def validates_city_id(self, key, value):
-        cities = [city.id for city in City.query.all()]
         if not value:
             raise ValueError(f'{key} must be provided.')
-        if value not in cities:
+        if not id_exists(City, value):
             raise ValueError('city_id does not exist.')
         return value
 
@@ -131,11 +212,13 @@ class CityNote(db.Model, SerializerMixin):
     def __repr__(self):
         return f'<City Note {self.id} :: {self.note_body} | {self.note_type} | city: {self.city_id}>'
 
+Index('city_notes_city_type_index', CityNote.city_id, CityNote.note_type)
+
 
 ###################### LOCATIONS ######################
 
 
-class Location(db.Model, SerializerMixin):
+class Location(db.Model, SerializerMixin, RowVersion):
     __tablename__ = 'locations'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -146,15 +229,20 @@ class Location(db.Model, SerializerMixin):
     website = db.Column(db.String)
     avg_cost = db.Column(db.Integer)
     category = db.Column(db.String)
+    lat = db.Column(db.Float)
+    lng = db.Column(db.Float)
+    # geohash of (lat, lng); prefix ranges on it back the map queries, so
+    # postgres gets the C collation to keep the ranges in byte order
+    geohash = db.Column(db.String().with_variant(postgresql.VARCHAR(collation='C'), 'postgresql'))
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
-    city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    city_id = db.Column(db.Integer, db.ForeignKey('cities.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     location_notes = db.relationship(
-        "LocationNote", backref='location', cascade='all, delete, delete-orphan')
+        "LocationNote", backref='location', cascade='all, delete-orphan', passive_deletes=True)
 
     serialize_rules = ("-city",
-                       "-user", "-location_notes.location", "-created_at", "-updated_at",)
+                       "-user", "-location_notes.location", "-created_at", "-updated_at", "-geohash",)
 
     @validates('category')
     def validates_category(self, key, value):
@@ -184,28 +272,47 @@ class Location(db.Model, SerializerMixin):
             raise ValueError(f'{value} not an allowed value for rating.')
         return value
 
+    @validates('lat', 'lng')
+    def validates_coordinates(self, key, value):
+        return geo.coordinate(key, value)
+
     @validates('user_id')
     def validates_user_id(self, key, value):
-        users = [user.id for user in User.query.all()]
-        if value not in users:
+        if not id_exists(User, value):
             raise ValueError('user_id does not exist.')
         return value
 
     @validates('city_id')
     def validates_city_id(self, key, value):
-        cities = [city.id for city in City.query.all()]
-        if value not in cities:
+        if not id_exists(City, value):
             raise ValueError('city_id does not exist.')
         return value
 
     def __repr__(self):
         return f'<Location {self.id} :: {self.location_name} | city: {self.city_id} | user: {self.user_id}>'
 
+Index('locations_city_category_index', Location.city_id, Location.category)
+Index('locations_user_city_index', Location.user_id, Location.city_id)
+Index('locations_geohash_index', Location.geohash)
+
+
+@event.listens_for(Location, 'before_insert')
+@event.listens_for(Location, 'before_update')
+def locate(mapper, connection, target):
+    # Coordinates sent with the request win; otherwise they follow the map url.
+    attrs = inspect(target).attrs
+    url_changed = attrs.google_map_url.history.has_changes()
+    coords_changed = attrs.lat.history.has_changes() or attrs.lng.history.has_changes()
+    if url_changed and not coords_changed:
+        target.lat = target.lng = None
+    point = geo.point_fields(target.lat, target.lng, target.google_map_url)
+    target.lat, target.lng, target.geohash = point['lat'], point['lng'], point['geohash']
+
 
 ###################### LOCATION NOTES ######################
 
 
-class LocationNote(db.Model, SerializerMixin):
+class LocationNote(db.Model, SerializerMixin, RowVersion):
     __tablename__ = 'locationNotes'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -214,7 +321,7 @@ class LocationNote(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, onupdate=db.func.now())
     location_id = db.Column(db.Integer, db.ForeignKey(
-        'locations.id'), nullable=False)
+        'locations.id', ondelete='CASCADE'), nullable=False)
 
     serialize_rules = ("-location",
                        "-created_at", "-updated_at","-location_id",)
@@ -227,10 +334,84 @@ class LocationNote(db.Model, SerializerMixin):
 
     @validates('location_id')
     def validates_location_id(self, key, value):
-        locations = [loc.id for loc in Location.query.all()]
-        if value not in locations:
+        if not id_exists(Location, value):
             raise ValueError('location_id does not exist.')
         return value
 
     def __repr__(self):
         return f'<Location Note {self.id} :: {self.note_body} | Location: {self.location_id} >'
+
+Index('location_notes_location_index', LocationNote.location_id)
+
+
+###################### USER STATS ######################
+
+
+class UserStats(db.Model):
+    """Running totals of a user's rows, kept up to date by stats.py as they
+    are written so reading them never scans the user's data."""
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    cities = db.Column(db.Integer, nullable=False, default=0)
+    city_notes = db.Column(db.Integer, nullable=False, default=0)
+    locations = db.Column(db.Integer, nullable=False, default=0)
+    location_notes = db.Column(db.Integer, nullable=False, default=0)
+    rated_locations = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+    def __repr__(self):
+        return f'<UserStats {self.user_id} :: {self.cities} cities | {self.locations} locations>'
+
+
+class UserStatCount(db.Model):
+    """Per-key counts behind the user's stats: cities per country (so the
+    number of countries is the number of rows) and locations per category.
+    Rows are dropped when their count reaches zero."""
+    __tablename__ = 'user_stat_counts'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    dimension = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserStatCount {self.user_id} :: {self.dimension} {self.key} | {self.count}>'
+
+
+###################### JOBS ######################
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Job(db.Model, SerializerMixin):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    payload = db.Column(db.JSON().with_variant(postgresql.JSONB(), 'postgresql'))
+    # queued -> running -> succeeded | failed; a failed attempt goes back to
+    # queued until max_attempts is reached
+    status = db.Column(db.String, nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    result = db.Column(db.JSON().with_variant(postgresql.JSONB(), 'postgresql'))
+    error = db.Column(db.String)
+    # set in python rather than by the server: the worker compares them with
+    # its own clock when scheduling retries and expiring leases
+    run_after = db.Column(db.DateTime, nullable=False, default=utcnow)
+    locked_by = db.Column(db.String)
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    serialize_rules = ("-payload", "-locked_by", "-locked_at", "-run_after",)
+
+    def __repr__(self):
+        return f'<Job {self.id} :: {self.kind} | {self.status} | attempt {self.attempts}/{self.max_attempts}>'
+
+Index('jobs_status_run_after_index', Job.status, Job.run_after)
+Index('jobs_kind_status_index', Job.kind, Job.status)
@@ -0,0 +1,61 @@
+# Standard library imports
+from datetime import datetime
+from urllib.parse import urlencode
+
+# Remote library imports
+from flask import request
+from sqlalchemy import Integer, DateTime
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def _coerce(column, value):
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def filter_query(query, model, args, filters):
+    """Applies `col=`, `col_gte=` and `col_lte=` query params for every
+    column named in `filters`. Raises ValueError on a malformed value."""
+    for name in filters:
+        column = getattr(model, name)
+        try:
+            if name in args:
+                query = query.filter(column == _coerce(column, args[name]))
+            if f'{name}_gte' in args:
+                query = query.filter(column >= _coerce(column, args[f'{name}_gte']))
+            if f'{name}_lte' in args:
+                query = query.filter(column <= _coerce(column, args[f'{name}_lte']))
+        except ValueError:
+            raise ValueError(f'invalid value for {name} filter.')
+    return query
+
+
+def page_args(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+        after = int(args['after']) if 'after' in args else None
+    except ValueError:
+        raise ValueError('limit and after must be integers.')
+    if limit < 1:
+        raise ValueError('limit must be positive.')
+    return min(limit, MAX_LIMIT), after
+
+
+def paginate(query, model, args):
+    """Keyset pagination on the primary key: `?limit=&after=<last id>`.
+    Only `limit + 1` rows are fetched no matter how large the table is.
+    Returns the page and the url of the next page (None on the last one)."""
+    limit, after = page_args(args)
+    if after is not None:
+        query = query.filter(model.id > after)
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    next_args = {**args.to_dict(), 'limit': limit, 'after': rows[-1].id}
+    return rows, f'{request.base_url}?{urlencode(next_args)}'
@@ -0,0 +1,153 @@
+# Standard library imports
+import os
+import threading
+import time
+
+# Remote library imports
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool, NullPool
+
+
+class PoolMetrics:
+    """Process-wide counters fed by the pool events below. Gunicorn workers
+    each have their own pool, so each reports its own numbers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.overflow_checkouts = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def count(self, name):
+        # pool events fire on whichever thread checks a connection in or
+        # out, and += on an attribute is not atomic
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def waited(self, seconds, timed_out=False, overflow=False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            self.timeouts += timed_out
+            self.overflow_checkouts += overflow
+
+    def stats(self, pool=None):
+        with self._lock:
+            data = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'overflow_checkouts': self.overflow_checkouts,
+                'invalidations': self.invalidations,
+                'soft_invalidations': self.soft_invalidations,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), checked_out=pool.checkedout(),
+                        overflow=max(pool.overflow(), 0), idle=pool.checkedin())
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    # The pool events fire once a connection is handed out, so the time
+    # spent queueing for one (and whether it came from the overflow) is
+    # measured around the checkout itself.
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.waited(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.waited(time.perf_counter() - start, overflow=self.checkedout() > self.size())
+        return connection
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    # Async drivers (asgi.py) wait for a connection on an asyncio queue, so
+    # a full pool suspends the request instead of blocking the event loop.
+    pass
+
+
+@event.listens_for(Pool, 'connect')
+def count_connect(dbapi_connection, connection_record):
+    pool_metrics.count('connects')
+
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.count('checkouts')
+
+
+@event.listens_for(Pool, 'checkin')
+def count_checkin(dbapi_connection, connection_record):
+    pool_metrics.count('checkins')
+
+
+@event.listens_for(Pool, 'invalidate')
+def count_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.count('invalidations')
+
+
+@event.listens_for(Pool, 'soft_invalidate')
+def count_soft_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.count('soft_invalidations')
+
+
+def _flag(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(url, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* variables.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds), DB_POOL_RECYCLE
+    (seconds, -1 disables) and DB_POOL_PRE_PING size the per-worker pool;
+    servers default to pre-ping on and a 30 minute recycle so connections
+    dropped while idle are replaced instead of failing a request.
+    DB_PGBOUNCER=transaction hands pooling to PgBouncer: no local pool, and
+    no server-side prepared statements, which transaction pooling breaks.
+    """
+    if not url:
+        return {}
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # in-memory databases live in a single connection; keep the default
+        return {}
+    server = url.get_backend_name() != 'sqlite'
+
+    if environ.get('DB_PGBOUNCER', '').lower() == 'transaction':
+        options = {'poolclass': NullPool, 'pool_pre_ping': False}
+        if url.get_driver_name() == 'asyncpg':
+            options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+        elif url.get_driver_name() == 'psycopg':
+            options['connect_args'] = {'prepare_threshold': None}
+        return options
+
+    return {
+        'poolclass': TimedAsyncQueuePool if url.get_dialect().is_async else TimedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800 if server else -1)),
+        'pool_pre_ping': _flag(environ, 'DB_POOL_PRE_PING', server),
+    }
@@ -0,0 +1,165 @@
+# Standard library imports
+import json
+import logging
+import os
+import time
+import traceback
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+# Remote library imports
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Local imports
+from config import app
+
+# PROFILE_REQUESTS=all traces every request, =header only those sent with
+# `X-Profile: 1`; unset, none of the hooks below do any work.
+MODE = os.environ.get('PROFILE_REQUESTS', '').lower()
+SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+REPEAT_THRESHOLD = int(os.environ.get('PROFILE_REPEAT_THRESHOLD', 5))
+# defaults to the Flask instance folder, not whatever directory the server
+# was started from
+LOG_PATH = os.environ.get('PROFILE_LOG') or os.path.join(app.instance_path, 'profile.jsonl')
+LOG_BYTES = int(os.environ.get('PROFILE_LOG_BYTES', 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get('PROFILE_LOG_BACKUPS', 5))
+STACK_DEPTH = 6
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_trace = ContextVar('profile_trace', default=None)
+
+
+class Trace:
+    __slots__ = ('start', 'statements', 'serialize_seconds', 'requested')
+
+    def __init__(self, requested):
+        self.start = time.perf_counter()
+        self.statements = []
+        self.serialize_seconds = 0.0
+        self.requested = requested
+
+    def repeated(self):
+        """Statements run REPEAT_THRESHOLD or more times with the same SQL:
+        the shape a lazy load or per-row lookup inside a loop leaves."""
+        groups = {}
+        for statement in self.statements:
+            groups.setdefault(statement['sql'], []).append(statement)
+        return [{
+            'sql': sql,
+            'count': len(runs),
+            'ms': round(sum(run['ms'] for run in runs), 3),
+            'stack': runs[0]['stack'],
+        } for sql, runs in groups.items() if len(runs) >= REPEAT_THRESHOLD]
+
+
+def current_trace():
+    return _trace.get()
+
+
+def _call_site():
+    # innermost frames from this app's own modules, skipping this file
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(SERVER_DIR) and frame.filename != __file__]
+    return [f'{os.path.relpath(frame.filename, SERVER_DIR)}:{frame.lineno} {frame.name}'
+            for frame in frames[-STACK_DEPTH:]]
+
+
+###################### HOOKS ######################
+
+@app.before_request
+def start_trace():
+    if not MODE:
+        return
+    requested = request.headers.get('X-Profile') == '1'
+    if MODE == 'all' or (MODE == 'header' and requested):
+        _trace.set(Trace(requested))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_traced_statement(conn, cursor, statement, parameters, context, executemany):
+    # on the execution context, like metrics.py, so a failed statement
+    # leaves nothing behind on the connection
+    if _trace.get() is not None:
+        if context is None:
+            conn.info['profile_start'] = time.perf_counter()
+        else:
+            context.profile_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_traced_statement(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    if context is None:
+        start = conn.info.pop('profile_start', None)
+    else:
+        start = getattr(context, 'profile_start', None)
+    if trace is None or start is None:
+        return
+    elapsed = time.perf_counter() - start
+    trace.statements.append({
+        'sql': statement,
+        'ms': round(elapsed * 1000, 3),
+        'rows': len(parameters) if executemany else 1,
+        'stack': _call_site(),
+    })
+
+
+@app.after_request
+def finish_trace(response):
+    trace = _trace.get()
+    if trace is None:
+        return response
+    _trace.set(None)
+    total_ms = (time.perf_counter() - trace.start) * 1000
+    db_ms = sum(statement['ms'] for statement in trace.statements)
+    serialize_ms = trace.serialize_seconds * 1000
+    response.headers['Server-Timing'] = (
+        f'db;dur={db_ms:.2f};desc="{len(trace.statements)} queries", '
+        f'serialize;dur={serialize_ms:.2f}, total;dur={total_ms:.2f}')
+
+    repeated = trace.repeated()
+    reasons = [reason for reason, hit in (
+        ('slow', total_ms >= SLOW_MS),
+        ('n_plus_one', bool(repeated)),
+        ('requested', trace.requested),
+    ) if hit]
+    if reasons:
+        _write({
+            'at': datetime.now(timezone.utc).isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'route': request.url_rule.rule if request.url_rule else None,
+            'status': response.status_code,
+            'reasons': reasons,
+            'total_ms': round(total_ms, 3),
+            'db_ms': round(db_ms, 3),
+            'serialize_ms': round(serialize_ms, 3),
+            'query_count': len(trace.statements),
+            'n_plus_one': repeated,
+            'statements': trace.statements,
+        })
+    return response
+
+
+@app.teardown_request
+def drop_trace(exc):
+    _trace.set(None)
+
+
+###################### LOG ######################
+
+_log = logging.getLogger('vicariously.profile')
+_log.propagate = False
+
+
+def _write(record):
+    if not _log.handlers:
+        os.makedirs(os.path.dirname(os.path.abspath(LOG_PATH)), exist_ok=True)
+        handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_BYTES, backupCount=LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _log.addHandler(handler)
+        _log.setLevel(logging.INFO)
+    _log.info(json.dumps(record, default=str))
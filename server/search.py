@@ -0,0 +1,245 @@
+# Remote library imports
+from sqlalchemy import column, delete, event, inspect, select, table, text
+from sqlalchemy.orm import Session
+
+# Local imports
+from config import app, db
+from jobs import job
+from models import User, City, CityNote, Location, LocationNote
+
+# model -> (doc_type, indexed attribute, type code used in SQLite rowids)
+DOCUMENTS = {
+    City: ('city', 'city_name', 0),
+    Location: ('location', 'location_name', 1),
+    CityNote: ('city_note', 'note_body', 2),
+    LocationNote: ('location_note', 'note_body', 3),
+}
+DOC_TYPES = {doc_type: model for model, (doc_type, _, _) in DOCUMENTS.items()}
+DOCS_TABLE = table('search_documents', column('rowid'), column('doc_type'), column('doc_id'))
+SOURCES = {
+    'city': ('cities', 'city_name'),
+    'location': ('locations', 'location_name'),
+    'city_note': ('"cityNotes"', 'note_body'),
+    'location_note': ('"locationNotes"', 'note_body'),
+}
+
+
+class SqliteSearch:
+    """FTS5 table for local development and benchmarks. Rows are keyed by
+    rowid = doc_id * 4 + type code, so updates and deletes hit the b-tree
+    instead of scanning the unindexed columns."""
+
+    def create(self, conn):
+        conn.execute(text(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS search_documents '
+            'USING fts5(doc_type UNINDEXED, doc_id UNINDEXED, body)'))
+
+    def drop(self, conn):
+        conn.execute(text('DROP TABLE IF EXISTS search_documents'))
+
+    def upsert(self, conn, docs):
+        self.delete(conn, [(doc_type, doc_id) for doc_type, doc_id, _ in docs])
+        conn.execute(
+            text('INSERT INTO search_documents (rowid, doc_type, doc_id, body) '
+                 'VALUES (:rowid, :doc_type, :doc_id, :body)'),
+            [{'rowid': self._rowid(t, i), 'doc_type': t, 'doc_id': i, 'body': b} for t, i, b in docs])
+
+    def delete(self, conn, keys):
+        if not keys:
+            return
+        conn.execute(text('DELETE FROM search_documents WHERE rowid = :rowid'),
+                     [{'rowid': self._rowid(t, i)} for t, i in keys])
+
+    def delete_selected(self, conn, doc_type, ids):
+        code = DOCUMENTS[DOC_TYPES[doc_type]][2]
+        selected = ids.subquery()
+        conn.execute(delete(DOCS_TABLE).where(
+            DOCS_TABLE.c.rowid.in_(select(selected.c.id * 4 + code))))
+
+    def rebuild(self, conn):
+        conn.execute(text('DELETE FROM search_documents'))
+        for doc_type, (table, column) in SOURCES.items():
+            code = DOCUMENTS[DOC_TYPES[doc_type]][2]
+            conn.execute(text(
+                f'INSERT INTO search_documents (rowid, doc_type, doc_id, body) '
+                f"SELECT id * 4 + {code}, '{doc_type}', id, {column} FROM {table}"))
+
+    def search(self, conn, q, types, limit, offset):
+        terms = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in q.split())
+        where = 'search_documents MATCH :terms'
+        if types:
+            where += ' AND doc_type IN ({})'.format(', '.join(f':t{n}' for n in range(len(types))))
+        return conn.execute(
+            text(f'SELECT doc_type, doc_id, body, -bm25(search_documents) AS rank '
+                 f'FROM search_documents WHERE {where} ORDER BY rank DESC LIMIT :limit OFFSET :offset'),
+            {'terms': terms, 'limit': limit, 'offset': offset,
+             **{f't{n}': t for n, t in enumerate(types)}}).all()
+
+    @staticmethod
+    def _rowid(doc_type, doc_id):
+        return doc_id * 4 + DOCUMENTS[DOC_TYPES[doc_type]][2]
+
+
+class PostgresSearch:
+    """Plain table with a generated tsvector column and a GIN index."""
+
+    def create(self, conn):
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS search_documents ('
+            'doc_type VARCHAR NOT NULL, doc_id INTEGER NOT NULL, body TEXT NOT NULL, '
+            "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', body)) STORED, "
+            'PRIMARY KEY (doc_type, doc_id))'))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS search_documents_tsv_index '
+            'ON search_documents USING GIN (tsv)'))
+
+    def drop(self, conn):
+        conn.execute(text('DROP TABLE IF EXISTS search_documents'))
+
+    def upsert(self, conn, docs):
+        conn.execute(
+            text('INSERT INTO search_documents (doc_type, doc_id, body) '
+                 'VALUES (:doc_type, :doc_id, :body) '
+                 'ON CONFLICT (doc_type, doc_id) DO UPDATE SET body = excluded.body'),
+            [{'doc_type': t, 'doc_id': i, 'body': b} for t, i, b in docs])
+
+    def delete(self, conn, keys):
+        conn.execute(text('DELETE FROM search_documents WHERE doc_type = :doc_type AND doc_id = :doc_id'),
+                     [{'doc_type': t, 'doc_id': i} for t, i in keys])
+
+    def delete_selected(self, conn, doc_type, ids):
+        conn.execute(delete(DOCS_TABLE).where(
+            DOCS_TABLE.c.doc_type == doc_type, DOCS_TABLE.c.doc_id.in_(ids)))
+
+    def rebuild(self, conn):
+        conn.execute(text('TRUNCATE search_documents'))
+        for doc_type, (table, column) in SOURCES.items():
+            conn.execute(text(
+                f'INSERT INTO search_documents (doc_type, doc_id, body) '
+                f"SELECT '{doc_type}', id, {column} FROM {table}"))
+
+    def search(self, conn, q, types, limit, offset):
+        where = "tsv @@ websearch_to_tsquery('simple', :q)"
+        if types:
+            where += ' AND doc_type = ANY(:types)'
+        return conn.execute(
+            text(f"SELECT doc_type, doc_id, body, ts_rank(tsv, websearch_to_tsquery('simple', :q)) AS rank "
+                 f'FROM search_documents WHERE {where} ORDER BY rank DESC LIMIT :limit OFFSET :offset'),
+            {'q': q, 'types': list(types), 'limit': limit, 'offset': offset}).all()
+
+
+def backend(conn):
+    return PostgresSearch() if conn.dialect.name == 'postgresql' else SqliteSearch()
+
+
+# db.create_all()/drop_all() manage the search table too.
+@event.listens_for(db.metadata, 'after_create')
+def create_search_table(target, connection, **kw):
+    backend(connection).create(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_table(target, connection, **kw):
+    backend(connection).drop(connection)
+
+
+###################### INCREMENTAL UPDATES ######################
+
+def index_rows(session, model, ids):
+    """Indexes rows written outside the unit of work (bulk insert())."""
+    if model not in DOCUMENTS:
+        return
+    doc_type, attr, _ = DOCUMENTS[model]
+    rows = session.query(model.id, getattr(model, attr)).filter(model.id.in_(ids)).all()
+    if rows:
+        conn = session.connection()
+        backend(conn).upsert(conn, [(doc_type, id, body) for id, body in rows])
+
+
+@event.listens_for(Session, 'after_flush')
+def update_search_index(session, flush_context):
+    # Runs inside the flushing transaction, so the index commits or rolls
+    # back together with the rows it describes.
+    upserts, deletes = [], []
+    for obj in session.new:
+        if type(obj) in DOCUMENTS:
+            doc_type, attr, _ = DOCUMENTS[type(obj)]
+            upserts.append((doc_type, obj.id, getattr(obj, attr)))
+    for obj in session.dirty:
+        if type(obj) in DOCUMENTS:
+            doc_type, attr, _ = DOCUMENTS[type(obj)]
+            if inspect(obj).attrs[attr].history.has_changes():
+                upserts.append((doc_type, obj.id, getattr(obj, attr)))
+    for obj in session.deleted:
+        if type(obj) in DOCUMENTS:
+            deletes.append((DOCUMENTS[type(obj)][0], obj.id))
+    if upserts or deletes:
+        conn = session.connection()
+        search = backend(conn)
+        if upserts:
+            search.upsert(conn, upserts)
+        if deletes:
+            search.delete(conn, deletes)
+
+
+# Documents of the rows ON DELETE CASCADE removes along with a deleted
+# parent, as selects of their ids given the parent ids.
+DESCENDANT_DOCUMENTS = {
+    User: (
+        ('city', lambda ids: select(City.id).where(City.user_id.in_(ids))),
+        ('location', lambda ids: select(Location.id).where(Location.user_id.in_(ids))),
+        ('city_note', lambda ids: select(CityNote.id).join(City).where(City.user_id.in_(ids))),
+        ('location_note', lambda ids: select(LocationNote.id).join(Location).where(Location.user_id.in_(ids))),
+    ),
+    City: (
+        ('location', lambda ids: select(Location.id).where(Location.city_id.in_(ids))),
+        ('city_note', lambda ids: select(CityNote.id).where(CityNote.city_id.in_(ids))),
+        ('location_note', lambda ids: select(LocationNote.id).join(Location).where(Location.city_id.in_(ids))),
+    ),
+    Location: (
+        ('location_note', lambda ids: select(LocationNote.id).where(LocationNote.location_id.in_(ids))),
+    ),
+}
+
+
+@event.listens_for(Session, 'before_flush')
+def drop_descendant_documents(session, flush_context, instances):
+    # The children never enter the session (passive_deletes), so their
+    # documents are deleted by query while the rows can still be found.
+    deleted = {}
+    for obj in session.deleted:
+        if type(obj) in DESCENDANT_DOCUMENTS and obj.id is not None:
+            deleted.setdefault(type(obj), []).append(obj.id)
+    if not deleted:
+        return
+    conn = session.connection()
+    search = backend(conn)
+    for model, ids in deleted.items():
+        for doc_type, descendants in DESCENDANT_DOCUMENTS[model]:
+            search.delete_selected(conn, doc_type, descendants(ids))
+
+
+def search_documents(q, types=(), limit=20, offset=0):
+    conn = db.session.connection()
+    return backend(conn).search(conn, q, tuple(types), limit, offset)
+
+
+def rebuild_index():
+    conn = db.session.connection()
+    search = backend(conn)
+    search.create(conn)
+    search.rebuild(conn)
+    db.session.commit()
+
+
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    """Recreates the search index from the source tables."""
+    rebuild_index()
+    print('search index rebuilt')
+
+
+@job('rebuild_search', concurrency=1)
+def rebuild_search_job(payload):
+    rebuild_index()
+    return {}
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 # Standard library imports
+import argparse
 import random
 
 # Remote library imports
@@ -11,8 +12,32 @@ import re
 # Local imports
 from app import app
 from models import db, User, City, Location,CityNote,LocationNote
+from seeding import Profile, seed, finish
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Seeds the demo data, or with --users a generated dataset of that size.')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--cities-per-user', type=int, default=5)
+    parser.add_argument('--locations-per-city', type=int, default=10)
+    parser.add_argument('--notes-per-city', type=int, default=2)
+    parser.add_argument('--notes-per-location', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-rows', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
+    args = parse_args()
+    if args.users:
+        profile = Profile(args.users, args.cities_per_user, args.locations_per_city,
+                          args.notes_per_city, args.notes_per_location)
+        seed(app.config['SQLALCHEMY_DATABASE_URI'], profile,
+             workers=args.workers, chunk_rows=args.chunk_rows, rng_seed=args.seed)
+        raise SystemExit
+
     faker = Faker()
 
     with app.app_context():
@@ -39,7 +64,6 @@ if __name__ == '__main__':
                 travel_style = travel_style_rand
             )
             db.session.add(user)
-            db.session.commit()
             styles.remove(travel_style_rand)
         user_ids = [user.id for user in User.query.all()]
         
@@ -51,7 +75,6 @@ if __name__ == '__main__':
             user_id =  user_ids[0]
         )
         db.session.add(ireland)
-        db.session.commit()
         
         seoul = City(
             city_name = 'Seoul',
@@ -59,7 +82,6 @@ if __name__ == '__main__':
             user_id =  user_ids[0]
         )
         db.session.add(seoul)
-        db.session.commit()
 
         seoul2 = City(
             city_name = 'Seoul',
@@ -67,7 +89,6 @@ if __name__ == '__main__':
             user_id =  user_ids[1]
         )
         db.session.add(seoul2)
-        db.session.commit()
         
         city_ids = [city.id for city in City.query.all()]
         
@@ -78,7 +99,6 @@ if __name__ == '__main__':
             city_id = city_ids[0]
         )
         db.session.add(Killarney1)
-        db.session.commit()
         
         
         seoul1 = CityNote(
@@ -86,7 +106,6 @@ if __name__ == '__main__':
             city_id = city_ids[1]
         )
         db.session.add(seoul1)
-        db.session.commit()
         
         seoul2 = CityNote(
             note_body =  'subway - well connected, but ends at midnight.',
@@ -94,7 +113,6 @@ if __name__ == '__main__':
             city_id = city_ids[1]
         )
         db.session.add(seoul2)
-        db.session.commit()
         
         seoul3 = CityNote(
             note_body =  'buses - some run late night, some end early.',
@@ -102,7 +120,6 @@ if __name__ == '__main__':
             city_id = city_ids[1]
         )
         db.session.add(seoul3)
-        db.session.commit()
         
         
         ############# * LOCATIONS * #############
@@ -119,7 +136,6 @@ if __name__ == '__main__':
             user_id = user_ids[0]
         )
         db.session.add(haneul)
-        db.session.commit()
     
         seoul_forest = Location(
             location_name = 'Seoul Forest Park (서울숲공원)',
@@ -133,7 +149,6 @@ if __name__ == '__main__':
             user_id = user_ids[0]
         )
         db.session.add(seoul_forest)
-        db.session.commit()
 
 
         kimbap = Location(
@@ -148,7 +163,6 @@ if __name__ == '__main__':
             user_id = user_ids[0]
         )
         db.session.add(kimbap)
-        db.session.commit()
         
         location_ids = [location.id for location in Location.query.all()]
         
@@ -160,47 +174,43 @@ if __name__ == '__main__':
             location_id = location_ids[1]
         )
         db.session.add(seoul_forest1)
-        db.session.commit()
         
         haneul1 = LocationNote(
             note_body =  'great city views, especially at night',
             location_id = location_ids[0]
         )
         db.session.add(haneul1)
-        db.session.commit()
         
         haneul2 = LocationNote(
             note_body =  'can take long stairs up/down or paid trolley.',
             location_id = location_ids[0]
         )
         db.session.add(haneul2)
-        db.session.commit()
         
         haneul3 = LocationNote(
             note_body =  'Must see Silver grass in the fall',
             location_id = location_ids[0]
         )
         db.session.add(haneul3)
-        db.session.commit()
         
         kimbap1 = LocationNote(
             note_body =  'Food is very affordable, 3,000-6,000 won',
             location_id = location_ids[2]
         )
         db.session.add(kimbap1)
-        db.session.commit()
         
         kimbap2 = LocationNote(
             note_body =  'Loved the Cheese Ramen (with egg) and the kimbap rolled in egg',
             location_id = location_ids[2]
         )
         db.session.add(kimbap2)
-        db.session.commit()
         
         kimbap3 = LocationNote(
             note_body =  'Not so good: bibimbap',
             location_id = location_ids[2]
         )
         db.session.add(kimbap3)
+
+        # the Query.delete() calls above bypass the search index hooks
+        finish(db.session.connection())
         db.session.commit()
-        
\ No newline at end of file
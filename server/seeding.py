@@ -0,0 +1,205 @@
+# Standard library imports
+import csv
+import io
+import multiprocessing
+import random
+import time
+
+# Remote library imports
+from faker import Faker
+from sqlalchemy import create_engine, delete, func, insert, select, text
+
+# Local imports
+from models import User, City, CityNote, Location, LocationNote, UserStats, UserStatCount
+from geo import encode
+from search import backend
+from stats import rebuild as rebuild_stats
+
+STYLES = ['Thrill-seeker', 'Foodie', 'Relaxer', 'Experiencer', 'Culture Seeker',
+          'Nature', 'Influencer', 'Party Animal', 'Shopper', 'Luxuriate']
+NOTE_TYPES = ['Communication', 'Transportation', 'Other']
+CATEGORIES = ['Shopping', 'Mart', 'FoodDrink', 'IndoorActivity', 'OutdoorActivity', 'Accommodation', 'Other']
+TABLES = (User, City, CityNote, Location, LocationNote)
+POOL_SIZE = 2000
+
+
+class Profile:
+    """Dataset shape. Ids are assigned arithmetically from it, so any range
+    of users can be generated independently of the others."""
+
+    def __init__(self, users, cities_per_user, locations_per_city,
+                 notes_per_city=2, notes_per_location=2):
+        self.users = users
+        self.cities_per_user = cities_per_user
+        self.locations_per_city = locations_per_city
+        self.notes_per_city = notes_per_city
+        self.notes_per_location = notes_per_location
+
+    def counts(self):
+        cities = self.users * self.cities_per_user
+        locations = cities * self.locations_per_city
+        return {
+            User: self.users,
+            City: cities,
+            CityNote: cities * self.notes_per_city,
+            Location: locations,
+            LocationNote: locations * self.notes_per_location,
+        }
+
+
+class Pools:
+    """Faker values drawn once per process and then sampled with
+    random.choices: calling a Faker provider per row is what makes naive
+    seeding slow, not the inserts."""
+
+    def __init__(self, seed):
+        faker = Faker()
+        Faker.seed(seed)
+        self.names = [faker.user_name() for _ in range(POOL_SIZE)]
+        self.domains = [faker.free_email_domain() for _ in range(50)]
+        self.cities = [(faker.city(), faker.country()) for _ in range(POOL_SIZE)]
+        self.places = [faker.company() for _ in range(POOL_SIZE)]
+        self.urls = [faker.url() for _ in range(200)]
+        self.sentences = [faker.sentence(nb_words=10) for _ in range(POOL_SIZE)]
+        self.dates = [faker.date_time_between('-8y', 'now') for _ in range(POOL_SIZE)]
+
+
+def _rows(profile, pools, first_user, last_user, rng):
+    """Rows per model for users first_user..last_user (inclusive)."""
+    p = profile
+    users, cities, city_notes, locations, location_notes = [], [], [], [], []
+    for user_id in range(first_user, last_user + 1):
+        name = rng.choice(pools.names)
+        users.append({'id': user_id, 'username': f'{name}{user_id}',
+                      'email': f'{name}{user_id}@{rng.choice(pools.domains)}',
+                      'travel_style': rng.choice(STYLES)})
+        for c in range(p.cities_per_user):
+            city_id = (user_id - 1) * p.cities_per_user + c + 1
+            city_name, country = rng.choice(pools.cities)
+            # (country, city_name, user_id) is unique; the suffix keeps it so
+            cities.append({'id': city_id, 'city_name': f'{city_name} {c + 1}', 'country': country,
+                           'user_id': user_id})
+            for n in range(p.notes_per_city):
+                city_notes.append({'id': (city_id - 1) * p.notes_per_city + n + 1,
+                                   'note_body': rng.choice(pools.sentences),
+                                   'note_type': rng.choice(NOTE_TYPES), 'city_id': city_id})
+            center_lat, center_lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+            for l in range(p.locations_per_city):
+                location_id = (city_id - 1) * p.locations_per_city + l + 1
+                lat = center_lat + rng.uniform(-0.1, 0.1)
+                lng = max(-180.0, min(180.0, center_lng + rng.uniform(-0.1, 0.1)))
+                locations.append({
+                    'id': location_id, 'location_name': rng.choice(pools.places),
+                    'date_visited': rng.choice(pools.dates), 'rating': rng.randint(1, 5),
+                    'google_map_url': None, 'website': rng.choice(pools.urls),
+                    'avg_cost': rng.randint(0, 3), 'category': rng.choice(CATEGORIES),
+                    'lat': lat, 'lng': lng, 'geohash': encode(lat, lng),
+                    'city_id': city_id, 'user_id': user_id,
+                })
+                for n in range(p.notes_per_location):
+                    location_notes.append({'id': (location_id - 1) * p.notes_per_location + n + 1,
+                                           'note_body': rng.choice(pools.sentences),
+                                           'location_id': location_id})
+    return {User: users, City: cities, CityNote: city_notes,
+            Location: locations, LocationNote: location_notes}
+
+
+def _copy(conn, model, rows):
+    # Postgres: COPY ... FROM STDIN is several times faster than executemany.
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        # an unquoted empty field is NULL in COPY's csv format
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        'COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            model.__tablename__, ', '.join(f'"{column}"' for column in columns)),
+        buffer)
+
+
+def _write(conn, rows_by_model):
+    for model in TABLES:
+        rows = rows_by_model[model]
+        if not rows:
+            continue
+        if conn.dialect.name == 'postgresql':
+            _copy(conn, model, rows)
+        else:
+            conn.execute(insert(model.__table__), rows)
+
+
+def _worker(url, profile, first_user, last_user, chunk_users, seed):
+    """Seeds a user range on its own engine; one transaction per chunk."""
+    engine = create_engine(url)
+    pools = Pools(seed)
+    rng = random.Random(seed)
+    try:
+        for start in range(first_user, last_user + 1, chunk_users):
+            rows = _rows(profile, pools, start, min(start + chunk_users - 1, last_user), rng)
+            with engine.begin() as conn:
+                _write(conn, rows)
+    finally:
+        engine.dispose()
+
+
+def clear(conn):
+    for model in (UserStatCount, UserStats) + tuple(reversed(TABLES)):
+        conn.execute(delete(model.__table__))
+
+
+def finish(conn):
+    """Moves serial sequences past the explicit ids and rebuilds the search
+    index and user stats, which the Core inserts bypassed."""
+    if conn.dialect.name == 'postgresql':
+        for model in TABLES:
+            table = model.__tablename__
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                f'COALESCE((SELECT MAX(id) FROM "{table}"), 0) + 1, false)'))
+    search = backend(conn)
+    search.rebuild(conn)
+    rebuild_stats(conn)
+
+
+def seed(url, profile, workers=1, chunk_rows=50_000, rng_seed=0, report=print):
+    """Fills the database described by `url` per `profile`. Returns
+    {model: rows} and reports rows per second along the way."""
+    engine = create_engine(url)
+    if engine.dialect.name == 'sqlite' and workers > 1:
+        report('sqlite allows one writer at a time; seeding with 1 worker.')
+        workers = 1
+    counts = profile.counts()
+    rows_per_user = max(1, sum(counts.values()) // max(profile.users, 1))
+    chunk_users = max(1, chunk_rows // rows_per_user)
+
+    with engine.begin() as conn:
+        clear(conn)
+    start = time.perf_counter()
+    if workers <= 1:
+        _worker(url, profile, 1, profile.users, chunk_users, rng_seed)
+    else:
+        engine.dispose()  # no pooled connections may cross the fork
+        per_worker = -(-profile.users // workers)
+        ranges = [(first, min(first + per_worker - 1, profile.users))
+                  for first in range(1, profile.users + 1, per_worker)]
+        with multiprocessing.Pool(len(ranges)) as pool:
+            pool.starmap(_worker, [(url, profile, first, last, chunk_users, rng_seed + n)
+                                   for n, (first, last) in enumerate(ranges)])
+    inserted = time.perf_counter() - start
+
+    with engine.begin() as conn:
+        finish(conn)
+        found = {model: conn.execute(select(func.count()).select_from(model.__table__)).scalar()
+                 for model in TABLES}
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    total = sum(found.values())
+    for model in TABLES:
+        report(f'{model.__tablename__:<14} {found[model]:>12,}')
+    report(f'{total:,} rows in {inserted:.1f}s ({total / inserted:,.0f} rows/s), '
+           f'{elapsed:.1f}s including the search index')
+    return found
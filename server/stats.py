@@ -0,0 +1,368 @@
+# Remote library imports
+import click
+from sqlalchemy import and_, delete, event, func, insert, inspect, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+# Local imports
+from config import app, db
+from models import User, City, CityNote, Location, LocationNote, UserStats, UserStatCount
+from jobs import job
+
+COUNTERS = ('cities', 'city_notes', 'locations', 'location_notes', 'rated_locations', 'rating_sum')
+# locations without a category are counted under this key
+NULL_KEY = 'null'
+# the columns whose changes move a row's contribution
+TRACKED = {
+    City: ('user_id', 'country'),
+    Location: ('user_id', 'category', 'rating'),
+    CityNote: ('city_id',),
+    LocationNote: ('location_id',),
+}
+PENDING_KEY = 'user_stats'
+
+
+class Deltas:
+    """Changes to the stats, per user: counter deltas and per-key count
+    deltas. Also used to hold a complete set of stats (deltas from zero)."""
+
+    def __init__(self):
+        self.counters = {}
+        self.counts = {}
+
+    def add(self, user_id, counter, delta):
+        if delta and user_id is not None:
+            counters = self.counters.setdefault(user_id, {})
+            counters[counter] = counters.get(counter, 0) + delta
+
+    def add_count(self, user_id, dimension, key, delta):
+        if delta and user_id is not None:
+            key = (user_id, dimension, key if key is not None else NULL_KEY)
+            self.counts[key] = self.counts.get(key, 0) + delta
+
+
+###################### CONTRIBUTIONS ######################
+
+# What the rows selected by `where` add to their users' stats, grouped so
+# the same four queries serve a single row, a deleted subtree and a full
+# rebuild.
+
+def _cities(where):
+    return select(City.user_id, City.country, func.count()).where(where).group_by(City.user_id, City.country)
+
+
+def _locations(where):
+    return (select(Location.user_id, Location.category, func.count(), func.count(Location.rating),
+                   func.coalesce(func.sum(Location.rating), 0))
+            .where(where).group_by(Location.user_id, Location.category))
+
+
+def _city_notes(where):
+    return (select(City.user_id, func.count()).select_from(CityNote)
+            .join(City, CityNote.city_id == City.id).where(where).group_by(City.user_id))
+
+
+def _location_notes(where):
+    return (select(Location.user_id, func.count()).select_from(LocationNote)
+            .join(Location, LocationNote.location_id == Location.id).where(where).group_by(Location.user_id))
+
+
+def collect(conn, deltas, sign, cities=None, locations=None, city_notes=None, location_notes=None):
+    """Adds `sign` times the contribution of the rows each clause selects."""
+    if cities is not None:
+        for user_id, country, count in conn.execute(_cities(cities)):
+            deltas.add(user_id, 'cities', sign * count)
+            deltas.add_count(user_id, 'country', country, sign * count)
+    if locations is not None:
+        for user_id, category, count, rated, rating_sum in conn.execute(_locations(locations)):
+            deltas.add(user_id, 'locations', sign * count)
+            deltas.add(user_id, 'rated_locations', sign * rated)
+            deltas.add(user_id, 'rating_sum', sign * rating_sum)
+            deltas.add_count(user_id, 'category', category, sign * count)
+    if city_notes is not None:
+        for user_id, count in conn.execute(_city_notes(city_notes)):
+            deltas.add(user_id, 'city_notes', sign * count)
+    if location_notes is not None:
+        for user_id, count in conn.execute(_location_notes(location_notes)):
+            deltas.add(user_id, 'location_notes', sign * count)
+
+
+def _insert(conn, model):
+    return (postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert)(model.__table__)
+
+
+def apply(conn, deltas, skip=()):
+    """Adds the deltas in place (upserts of `col = col + delta`), so
+    concurrent writers cannot lose each other's updates. `skip` are users
+    being deleted, whose stats go with them."""
+    stats = UserStats.__table__
+    for user_id, counters in deltas.counters.items():
+        counters = {name: delta for name, delta in counters.items() if delta}
+        if user_id in skip or not counters:
+            continue
+        stmt = _insert(conn, UserStats).values(user_id=user_id, **counters)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[stats.c.user_id],
+            set_={**{name: stats.c[name] + stmt.excluded[name] for name in counters},
+                  'updated_at': func.now()}))
+    counts, touched = UserStatCount.__table__, set()
+    for (user_id, dimension, key), delta in deltas.counts.items():
+        if user_id in skip or not delta:
+            continue
+        stmt = _insert(conn, UserStatCount).values(user_id=user_id, dimension=dimension, key=key, count=delta)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[counts.c.user_id, counts.c.dimension, counts.c.key],
+            set_={'count': counts.c.count + stmt.excluded['count']}))
+        touched.add(user_id)
+    if touched:
+        conn.execute(delete(counts).where(counts.c.user_id.in_(touched), counts.c.count <= 0))
+
+
+###################### INCREMENTAL UPDATES ######################
+
+def _ids(objects, model):
+    return [obj.id for obj in objects if type(obj) is model and obj.id is not None]
+
+
+def _in(column, ids, *also):
+    # None for no ids, which collect() skips, rather than an empty IN that
+    # still costs a query
+    if not ids:
+        return None
+    return and_(column.in_(ids), *also)
+
+
+def _changed(obj):
+    attrs = inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in TRACKED[type(obj)])
+
+
+def _moved(obj):
+    return type(obj) in (City, Location) and inspect(obj).attrs.user_id.history.has_changes()
+
+
+@event.listens_for(Session, 'before_flush')
+def subtract_old_stats(session, flush_context, instances):
+    # Deleted and updated rows are read back from the database while it
+    # still holds their old values. A deleted parent takes its whole subtree
+    # with it (ON DELETE CASCADE, never loaded into the session), so it is
+    # subtracted by query; loaded children deleted along with it are
+    # skipped so they are not counted twice.
+    deleted = [obj for obj in session.deleted if type(obj) in TRACKED or type(obj) is User]
+    dirty = [obj for obj in session.dirty
+             if type(obj) in TRACKED and obj.id is not None and session.is_modified(obj) and _changed(obj)]
+    moved = [obj for obj in dirty if _moved(obj)]
+    pending = session.info[PENDING_KEY] = {
+        'deltas': Deltas(),
+        'deleted_users': set(_ids(deleted, User)),
+        'dirty': {model: _ids(dirty, model) for model in TRACKED},
+        'moved': {model: _ids(moved, model) for model in (City, Location)},
+    }
+    if not (deleted or dirty):
+        return
+    conn = session.connection()
+    deltas = pending['deltas']
+    cities = _ids(deleted, City)
+    locations = _ids(deleted, Location)
+    collect(conn, deltas, -1,
+            cities=_in(City.id, cities),
+            locations=_in(Location.id, locations, Location.city_id.not_in(cities)),
+            city_notes=_in(CityNote.id, _ids(deleted, CityNote), CityNote.city_id.not_in(cities)),
+            location_notes=_in(LocationNote.id, _ids(deleted, LocationNote),
+                               LocationNote.location_id.not_in(locations), Location.city_id.not_in(cities)))
+    if cities:
+        collect(conn, deltas, -1, locations=Location.city_id.in_(cities),
+                city_notes=CityNote.city_id.in_(cities), location_notes=Location.city_id.in_(cities))
+    if locations:
+        locations = [id for (id,) in conn.execute(
+            select(Location.id).where(Location.id.in_(locations), Location.city_id.not_in(cities)))]
+    if locations:
+        collect(conn, deltas, -1, location_notes=LocationNote.location_id.in_(locations))
+    _collect_dirty(conn, deltas, -1, pending, touched_notes=_ids(dirty, CityNote), touched_location_notes=_ids(dirty, LocationNote))
+
+
+def _collect_dirty(conn, deltas, sign, pending, touched_notes, touched_location_notes):
+    dirty, moved = pending['dirty'], pending['moved']
+    if any(dirty.values()):
+        collect(conn, deltas, sign,
+                cities=_in(City.id, dirty[City]),
+                locations=_in(Location.id, dirty[Location]),
+                city_notes=_in(CityNote.id, dirty[CityNote]),
+                location_notes=_in(LocationNote.id, dirty[LocationNote]))
+    # a city or location given to another user takes its notes along
+    if moved[City]:
+        collect(conn, deltas, sign, city_notes=CityNote.city_id.in_(moved[City]) & CityNote.id.not_in(touched_notes))
+    if moved[Location]:
+        collect(conn, deltas, sign, location_notes=(LocationNote.location_id.in_(moved[Location])
+                                                    & LocationNote.id.not_in(touched_location_notes)))
+
+
+@event.listens_for(Session, 'after_flush')
+def add_new_stats(session, flush_context):
+    # New and updated rows are read back once flushed, so foreign keys set
+    # through relationships are in place. Runs inside the flushing
+    # transaction, so the stats commit or roll back with the rows.
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending is None:
+        return
+    new = {model: _ids(session.new, model) for model in TRACKED}
+    if any(new.values()) or any(pending['dirty'].values()):
+        conn = session.connection()
+        deltas = pending['deltas']
+        collect(conn, deltas, 1,
+                cities=_in(City.id, new[City]),
+                locations=_in(Location.id, new[Location]),
+                city_notes=_in(CityNote.id, new[CityNote]),
+                location_notes=_in(LocationNote.id, new[LocationNote]))
+        _collect_dirty(conn, deltas, 1, pending,
+                       touched_notes=pending['dirty'][CityNote] + new[CityNote],
+                       touched_location_notes=pending['dirty'][LocationNote] + new[LocationNote])
+    if pending['deltas'].counters or pending['deltas'].counts:
+        apply(session.connection(), pending['deltas'], pending['deleted_users'])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_pending_stats(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def count_bulk_inserts(orm_execute_state):
+    # Bulk insert(Model) statements (batch.create_all) skip the flush; their
+    # rows are counted from the parameters before they are inserted.
+    mapper = orm_execute_state.bind_mapper
+    if not orm_execute_state.is_insert or mapper is None or mapper.class_ not in TRACKED:
+        return
+    params = orm_execute_state.parameters
+    rows = params if isinstance(params, list) else [params or {}]
+    model, deltas = mapper.class_, Deltas()
+    conn = orm_execute_state.session.connection()
+    if model is City:
+        for row in rows:
+            deltas.add(row.get('user_id'), 'cities', 1)
+            deltas.add_count(row.get('user_id'), 'country', row.get('country'), 1)
+    elif model is Location:
+        for row in rows:
+            deltas.add(row.get('user_id'), 'locations', 1)
+            deltas.add_count(row.get('user_id'), 'category', row.get('category'), 1)
+            if row.get('rating') is not None:
+                deltas.add(row.get('user_id'), 'rated_locations', 1)
+                deltas.add(row.get('user_id'), 'rating_sum', row['rating'])
+    else:
+        parent, column, counter = ((City, 'city_id', 'city_notes') if model is CityNote
+                                   else (Location, 'location_id', 'location_notes'))
+        parents = [row.get(column) for row in rows]
+        owners = dict(conn.execute(select(parent.id, parent.user_id).where(parent.id.in_(set(parents)))).all())
+        for parent_id in parents:
+            deltas.add(owners.get(parent_id), counter, 1)
+    apply(conn, deltas)
+
+
+###################### READ ######################
+
+def user_stats(user_id):
+    """The user's stats from two primary key lookups, or None when there is
+    no such user."""
+    row = db.session.execute(select(UserStats.__table__).where(UserStats.user_id == user_id)).first()
+    if row is None and db.session.query(User.id).filter_by(id=user_id).scalar() is None:
+        return None
+    counts = {'country': {}, 'category': {}}
+    for dimension, key, count in db.session.execute(
+            select(UserStatCount.dimension, UserStatCount.key, UserStatCount.count)
+            .where(UserStatCount.user_id == user_id)):
+        counts[dimension][key] = count
+    totals = {name: getattr(row, name) if row else 0 for name in COUNTERS}
+    return {
+        'user_id': user_id,
+        'cities': totals['cities'],
+        'countries': len(counts['country']),
+        'cities_by_country': counts['country'],
+        'locations': totals['locations'],
+        'locations_by_category': counts['category'],
+        'rated_locations': totals['rated_locations'],
+        'average_rating': (round(totals['rating_sum'] / totals['rated_locations'], 2)
+                           if totals['rated_locations'] else None),
+        'city_notes': totals['city_notes'],
+        'location_notes': totals['location_notes'],
+    }
+
+
+###################### REBUILD ######################
+
+def expected(conn):
+    """Every user's stats computed from scratch, as Deltas from zero."""
+    deltas = Deltas()
+    collect(conn, deltas, 1, cities=true(), locations=true(), city_notes=true(), location_notes=true())
+    return deltas
+
+
+def stored(conn):
+    deltas = Deltas()
+    for row in conn.execute(select(UserStats.__table__)):
+        for name in COUNTERS:
+            deltas.add(row.user_id, name, getattr(row, name))
+    for user_id, dimension, key, count in conn.execute(
+            select(UserStatCount.user_id, UserStatCount.dimension, UserStatCount.key, UserStatCount.count)):
+        deltas.add_count(user_id, dimension, key, count)
+    return deltas
+
+
+def drift(conn):
+    """(user_id, stat, stored, expected) for every stored stat that differs
+    from a recomputation."""
+    want, have = expected(conn), stored(conn)
+    found = []
+    for user_id in sorted(set(want.counters) | set(have.counters)):
+        for name in COUNTERS:
+            right = want.counters.get(user_id, {}).get(name, 0)
+            actual = have.counters.get(user_id, {}).get(name, 0)
+            if right != actual:
+                found.append((user_id, name, actual, right))
+    for user_id, dimension, key in sorted(set(want.counts) | set(have.counts)):
+        right = want.counts.get((user_id, dimension, key), 0)
+        actual = have.counts.get((user_id, dimension, key), 0)
+        if right != actual:
+            found.append((user_id, f'{dimension}:{key}', actual, right))
+    return found
+
+
+def rebuild(conn):
+    """Replaces the stored stats with a recomputation."""
+    conn.execute(delete(UserStatCount.__table__))
+    conn.execute(delete(UserStats.__table__))
+    deltas = expected(conn)
+    rows = [{'user_id': user_id, **{name: counters.get(name, 0) for name in COUNTERS}}
+            for user_id, counters in deltas.counters.items()]
+    if rows:
+        conn.execute(insert(UserStats.__table__), rows)
+    counts = [{'user_id': user_id, 'dimension': dimension, 'key': key, 'count': count}
+              for (user_id, dimension, key), count in deltas.counts.items()]
+    if counts:
+        conn.execute(insert(UserStatCount.__table__), counts)
+
+
+@app.cli.command('rebuild-stats')
+@click.option('--check', is_flag=True, help='Only report drift; exit 1 if there is any.')
+def rebuild_stats(check):
+    """Recomputes user_stats from the source tables, reporting any drift."""
+    conn = db.session.connection()
+    found = drift(conn)
+    for user_id, stat, actual, right in found[:20]:
+        print(f'user {user_id} {stat}: stored {actual}, expected {right}')
+    if len(found) > 20:
+        print(f'... and {len(found) - 20} more')
+    if check:
+        print(f'{len(found)} drifted stat(s)')
+        raise SystemExit(1 if found else 0)
+    rebuild(conn)
+    db.session.commit()
+    print(f'user stats rebuilt, {len(found)} drifted stat(s) corrected')
+
+
+@job('rebuild_stats', concurrency=1)
+def rebuild_stats_job(payload):
+    conn = db.session.connection()
+    found = drift(conn)
+    rebuild(conn)
+    db.session.commit()
+    return {'drifted': len(found)}
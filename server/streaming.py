@@ -0,0 +1,20 @@
+# Remote library imports
+from flask import current_app, Response, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+STREAM_BATCH = 1000
+
+
+def wants_stream(request):
+    return request.args.get('stream') == '1' or NDJSON in request.headers.get('Accept', '')
+
+
+def stream_response(query, model, serialize):
+    """Sends one JSON object per line while the rows are still being read.
+    yield_per keeps at most STREAM_BATCH rows in memory (and turns on
+    server-side cursors on Postgres), so exports of any size run in
+    constant memory."""
+    def generate():
+        for row in query.order_by(model.id).yield_per(STREAM_BATCH):
+            yield current_app.json.dumpb(serialize(row)) + b'\n'
+    return Response(stream_with_context(generate()), 200, mimetype=NDJSON)
@@ -0,0 +1,67 @@
+# Remote library imports
+from sqlalchemy import select, func, literal, cast, null, String, Float, union_all
+
+# Local imports
+from config import db
+from models import City, CityNote, Location, LocationNote
+
+
+def _grouped(kind, model, key, *where, join=None, averages=False):
+    # every part has the same shape: (kind, key, count, avg rating, avg cost).
+    # key=None is a plain aggregate over all matching rows: Postgres rejects
+    # GROUP BY on a constant.
+    stmt = select(
+        literal(kind),
+        cast(key if key is not None else null(), String),
+        func.count(model.id),
+        cast(func.avg(Location.rating), Float) if averages else cast(null(), Float),
+        cast(func.avg(Location.avg_cost), Float) if averages else cast(null(), Float),
+    )
+    if join is not None:
+        stmt = stmt.join(*join)
+    stmt = stmt.where(*where)
+    return stmt.group_by(key) if key is not None else stmt
+
+
+def summary_query(city_id):
+    return union_all(
+        _grouped('category', Location, Location.category, Location.city_id == city_id, averages=True),
+        _grouped('rating', Location, Location.rating, Location.city_id == city_id),
+        _grouped('avg_cost', Location, Location.avg_cost, Location.city_id == city_id),
+        _grouped('note_type', CityNote, CityNote.note_type, CityNote.city_id == city_id),
+        _grouped('location_notes', LocationNote, None, Location.city_id == city_id,
+                 join=(Location, LocationNote.location_id == Location.id)),
+    )
+
+
+def city_summary(city):
+    """Per-category counts and averages, rating/avg_cost histograms and note
+    counts for one city, computed with GROUP BY in a single round trip."""
+    rows = db.session.execute(summary_query(city.id)).all()
+
+    summary = {
+        'id': city.id,
+        'city_name': city.city_name,
+        'country': city.country,
+        'user_id': city.user_id,
+        'locations_total': 0,
+        'categories': {},
+        'rating_histogram': {},
+        'avg_cost_histogram': {},
+        'city_notes': {},
+        'location_notes_total': 0,
+    }
+    for kind, key, count, avg_rating, avg_cost in rows:
+        key = key if key is not None else 'null'
+        if kind == 'category':
+            summary['locations_total'] += count
+            summary['categories'][key] = {'count': count, 'avg_rating': avg_rating, 'avg_cost': avg_cost}
+        elif kind == 'rating':
+            summary['rating_histogram'][key] = count
+        elif kind == 'avg_cost':
+            summary['avg_cost_histogram'][key] = count
+        elif kind == 'note_type':
+            summary['city_notes'][key] = count
+        else:
+            summary['location_notes_total'] = count
+    return summary
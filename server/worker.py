@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# Standard library imports
+import argparse
+import json
+import logging
+import signal
+
+# Local imports
+from app import app
+from jobs import HANDLERS, Worker, enqueue
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Runs queued background jobs, or with --enqueue adds one to the queue.')
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help='jobs this process runs at once')
+    parser.add_argument('--poll', type=float, help='seconds to sleep when the queue is empty')
+    parser.add_argument('--burst', action='store_true',
+                        help='exit once the queue is drained instead of waiting for more')
+    parser.add_argument('--enqueue', choices=sorted(HANDLERS), metavar='KIND',
+                        help=f'queue a job of this kind ({", ".join(sorted(HANDLERS))}) and exit')
+    parser.add_argument('--payload', type=json.loads, default={},
+                        help='JSON payload for --enqueue')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    if args.enqueue:
+        with app.app_context():
+            queued = enqueue(args.enqueue, args.payload)
+            print(f'queued job {queued.id} ({queued.kind})')
+        raise SystemExit
+
+    options = {'poll': args.poll} if args.poll is not None else {}
+    worker = Worker(concurrency=args.concurrency, burst=args.burst, **options)
+    # SIGTERM (and Ctrl-C) let the running jobs finish before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()